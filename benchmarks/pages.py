@@ -0,0 +1,88 @@
+"""
+Synthetic pages to measure how training and scraping scale.
+
+A page has a header with a title and an author, surrounded by nested
+filler markup, and a list of items with a title, an author and a link.
+"""
+
+import random
+import typing
+from collections import namedtuple
+
+PageConfig = namedtuple(
+    "PageConfig",
+    ["depth", "fanout", "list_length", "class_count", "ambiguity"],
+)
+PageConfig.__doc__ = """
+:param depth: levels of filler elements nested around and between the values
+:param fanout: filler siblings per level
+:param list_length: items in the list
+:param class_count: size of the css class vocabulary of the filler
+:param ambiguity: decoy copies of each header value in the filler
+"""
+
+# css rules of the generated structure, to build scrapers without training
+LIST_ITEM_RULE = "li.bench-item"
+LIST_VALUE_RULES = {
+    "title": "span.bench-title",
+    "author": "span.bench-author",
+    "link": "a.bench-link",
+}
+
+
+def generate_page(
+    config: PageConfig, seed: int = 0
+) -> typing.Tuple[str, dict, typing.List[dict]]:
+    """
+    Generate a page, deterministic for the same config and seed.
+    :return: html, header values, list of item values
+    """
+    rng = random.Random(seed)
+    classes = [f"c{i}" for i in range(config.class_count)]
+
+    header = {"title": f"title {seed}", "author": f"author {seed}"}
+    items = [
+        {
+            "title": f"item {seed}-{i}",
+            "author": f"user {rng.randrange(10**6)}",
+            "link": f"/items/{seed}/{i}",
+        }
+        for i in range(config.list_length)
+    ]
+
+    decoys = [value for value in header.values() for _ in range(config.ambiguity)]
+    rng.shuffle(decoys)
+
+    parts = ["<html><head><title>benchmark</title></head><body>"]
+    parts.append(_generate_filler(rng, config, classes, config.depth, decoys))
+    parts.append(
+        f'<div class="header"><h1>{header["title"]}</h1>'
+        f'<p class="by">{header["author"]}</p></div>'
+    )
+    parts.append(_generate_filler(rng, config, classes, config.depth, decoys))
+    parts.append('<ul class="bench-list">')
+    for item in items:
+        parts.append(
+            f'<li class="bench-item"><span class="bench-title">{item["title"]}</span>'
+            f'<span class="bench-author">{item["author"]}</span>'
+            f'<a class="bench-link" href="{item["link"]}">more</a></li>'
+        )
+    parts.append("</ul>")
+    # decoys left over go to the end
+    parts.extend(f"<p>{decoy}</p>" for decoy in decoys)
+    parts.append("</body></html>")
+    return "".join(parts), header, items
+
+
+def _generate_filler(rng, config: PageConfig, classes, depth: int, decoys) -> str:
+    if depth == 0:
+        if decoys and rng.random() < 0.5:
+            return f"<span>{decoys.pop()}</span>"
+        return f"<span>{rng.randrange(10**6)}</span>"
+
+    css_classes = " ".join(rng.sample(classes, min(2, len(classes))))
+    children = "".join(
+        _generate_filler(rng, config, classes, depth - 1, decoys)
+        for _ in range(config.fanout)
+    )
+    return f'<div class="{css_classes}">{children}</div>'
@@ -0,0 +1,323 @@
+"""
+Benchmark training and scraping on synthetic pages.
+
+Every phase of every scenario is timed (best of several runs) and its peak
+memory is traced in a separate run in a fresh process, so caches filled by
+the phases and scenarios before do not count. Results are compared to the stored
+baselines and the run fails if a phase got slower or bigger than allowed.
+
+Times depend on the machine and its load, so a fixed reference workload is
+timed in turns with every run of a phase. Phases are compared by their time
+relative to the reference run next to them, the median over all runs.
+
+    python -m benchmarks.run
+    python -m benchmarks.run --scenario wide --save
+"""
+
+import argparse
+import gc
+import json
+import logging
+import multiprocessing
+import statistics
+import sys
+import time
+import tracemalloc
+import typing
+from itertools import islice
+from pathlib import Path
+
+from benchmarks.pages import LIST_ITEM_RULE, LIST_VALUE_RULES, PageConfig, generate_page
+from mlscraper.plans import compile_scraper
+from mlscraper.samples import make_training_set, match_cache
+from mlscraper.scrapers import DictScraper, ListScraper, ValueScraper
+from mlscraper.selectors import selection_bits_cache
+from mlscraper.training import train_scraper
+from mlscraper.util import (
+    CssRuleSelector,
+    Page,
+    get_attribute_extractor,
+    get_text_extractor,
+)
+from mlscraper.xpath import LxmlPage
+
+BASELINES_PATH = Path(__file__).parent / "baselines.json"
+
+# pages per scenario, training uses all of them
+PAGE_COUNT = 3
+
+# path selectors generated per value node
+PATH_SELECTORS_MAX = 1000
+
+# allowed slowdown and growth compared to the baseline
+TIME_TOLERANCE = 0.5
+MEMORY_TOLERANCE = 0.2
+
+# differences below these are noise, whatever the ratio
+TIME_SLACK = 0.005
+MEMORY_SLACK = 64 * 1024
+
+# size of the reference workload, about as long as a small training run
+REFERENCE_SIZE = 20000
+
+SCENARIOS = {
+    "small": PageConfig(depth=3, fanout=3, list_length=10, class_count=20, ambiguity=0),
+    "deep": PageConfig(depth=40, fanout=1, list_length=10, class_count=20, ambiguity=0),
+    "wide": PageConfig(depth=2, fanout=40, list_length=10, class_count=20, ambiguity=0),
+    "long-list": PageConfig(
+        depth=3, fanout=3, list_length=1000, class_count=20, ambiguity=0
+    ),
+    "many-classes": PageConfig(
+        depth=3, fanout=6, list_length=10, class_count=1000, ambiguity=0
+    ),
+    "ambiguous": PageConfig(
+        depth=3, fanout=6, list_length=10, class_count=20, ambiguity=20
+    ),
+}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--scenario",
+        action="append",
+        choices=sorted(SCENARIOS),
+        help="scenario to run, all if not given",
+    )
+    parser.add_argument("--repeat", type=int, default=5, help="timed runs per phase")
+    parser.add_argument(
+        "--save", action="store_true", help="store the results as new baselines"
+    )
+    parser.add_argument("--baselines", type=Path, default=BASELINES_PATH)
+    parser.add_argument("--time-tolerance", type=float, default=TIME_TOLERANCE)
+    parser.add_argument("--memory-tolerance", type=float, default=MEMORY_TOLERANCE)
+    args = parser.parse_args(argv)
+
+    baselines = {}
+    if args.baselines.exists():
+        baselines = json.loads(args.baselines.read_text())
+
+    results = {}
+    regressions = []
+    for name in args.scenario or SCENARIOS:
+        results[name] = run_scenario(name, args.repeat)
+        for phase, result in results[name].items():
+            baseline = baselines.get(name, {}).get(phase)
+            problems = compare(
+                result, baseline, args.time_tolerance, args.memory_tolerance
+            )
+            regressions += [f"{name}/{phase}: {p}" for p in problems]
+            print(format_result(name, phase, result, baseline, problems))
+
+    if args.save:
+        baselines.update(results)
+        args.baselines.write_text(
+            json.dumps(baselines, indent=2, sort_keys=True) + "\n"
+        )
+        print(f"baselines saved to {args.baselines}")
+        return 0
+
+    for regression in regressions:
+        print(f"REGRESSION {regression}", file=sys.stderr)
+    return 1 if regressions else 0
+
+
+def run_scenario(name: str, repeat: int) -> dict:
+    results = {}
+    for phase, (setup, run) in _make_phases(SCENARIOS[name]).items():
+        # a new process per phase, modules keep caches of their own
+        with multiprocessing.get_context("spawn").Pool(1) as pool:
+            peak_bytes = pool.apply(_measure_peak_bytes, (name, phase))
+        # timed once the process is gone, it would compete for the cpu
+        seconds, relative_seconds = measure_seconds(setup, run, repeat)
+        results[phase] = {
+            "seconds": seconds,
+            "relative_seconds": relative_seconds,
+            "peak_bytes": peak_bytes,
+        }
+    return results
+
+
+def _measure_peak_bytes(name: str, phase: str) -> int:
+    setup, run = _make_phases(SCENARIOS[name])[phase]
+    return measure_peak_bytes(setup, run)
+
+
+def _make_phases(config: PageConfig) -> dict:
+    """
+    Setup and run function per phase, the result of setup is passed to run.
+    """
+    documents = [generate_page(config, seed) for seed in range(PAGE_COUNT)]
+    htmls = [html for html, _, _ in documents]
+    headers = [header for _, header, _ in documents]
+    item_lists = [items for _, _, items in documents]
+    values = [v for _, header, items in documents for v in header.values()] + [
+        v for _, _, items in documents for v in items[0].values()
+    ]
+
+    def parse_pages():
+        return [Page(html) for html in htmls]
+
+    def find_all(pages):
+        for page in pages:
+            for value in values:
+                page.find_all(value)
+
+    def generate_path_selectors(pages):
+        for page, header in zip(pages, headers):
+            for match in page.find_all(header["title"]):
+                list(islice(match.node.generate_path_selectors(), PATH_SELECTORS_MAX))
+
+    def train(pages):
+        train_scraper(make_training_set(pages, headers).item)
+
+    def train_list(pages):
+        train_scraper(make_training_set(pages, item_lists).item)
+
+    scraper = _make_list_scraper()
+    plan = compile_scraper(scraper)
+
+    def scrape(pages):
+        for page in pages:
+            scraper.get(page)
+
+    def scrape_plan(pages):
+        for page in pages:
+            plan.get(page)
+
+    def parse_and_scrape_lxml():
+        for html in htmls:
+            scraper.get(LxmlPage(html))
+
+    return {
+        "parse": (lambda: None, lambda _: parse_pages()),
+        "find_all": (parse_pages, find_all),
+        "generate_path_selectors": (parse_pages, generate_path_selectors),
+        "train": (parse_pages, train),
+        "train_list": (parse_pages, train_list),
+        "scrape": (parse_pages, scrape),
+        "scrape_plan": (parse_pages, scrape_plan),
+        "parse_and_scrape_lxml": (lambda: None, lambda _: parse_and_scrape_lxml()),
+    }
+
+
+def _make_list_scraper() -> ListScraper:
+    scraper_per_key = {
+        key: ValueScraper(
+            CssRuleSelector(css_rule),
+            get_attribute_extractor("href") if key == "link" else get_text_extractor(),
+        )
+        for key, css_rule in LIST_VALUE_RULES.items()
+    }
+    return ListScraper(CssRuleSelector(LIST_ITEM_RULE), DictScraper(scraper_per_key))
+
+
+def measure_seconds(
+    setup: typing.Callable, run: typing.Callable, repeat: int
+) -> typing.Tuple[float, float]:
+    """
+    Best time of repeat runs, setup excluded, and their median time relative
+    to the reference run right before each of them.
+
+    Like timeit, garbage collection is off while timing, its pauses depend on
+    everything allocated before.
+    """
+    seconds = []
+    reference_seconds = []
+    for _ in range(repeat):
+        _clear_caches()
+        argument = setup()
+        gc.collect()
+        gc.disable()
+        try:
+            reference_seconds.append(time_reference())
+            start = time.perf_counter()
+            run(argument)
+            seconds.append(time.perf_counter() - start)
+        finally:
+            gc.enable()
+    relative_seconds = [s / r for s, r in zip(seconds, reference_seconds)]
+    return min(seconds), statistics.median(relative_seconds)
+
+
+def measure_peak_bytes(setup: typing.Callable, run: typing.Callable) -> int:
+    """
+    Peak memory allocated by one traced run, setup excluded.
+    """
+    _clear_caches()
+    argument = setup()
+    tracemalloc.start()
+    try:
+        tracemalloc.reset_peak()
+        start_size, _ = tracemalloc.get_traced_memory()
+        run(argument)
+        _, peak_size = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak_size - start_size
+
+
+def time_reference() -> float:
+    """
+    Time of a fixed pure Python workload, independent of mlscraper.
+    """
+    start = time.perf_counter()
+    words = sorted(str(i * 7919 % REFERENCE_SIZE) for i in range(REFERENCE_SIZE))
+    counts = {}
+    for word in words:
+        counts[word[:3]] = counts.get(word[:3], 0) + 1
+    return time.perf_counter() - start
+
+
+def _clear_caches():
+    # runs must not profit from the ones before
+    match_cache.clear()
+    selection_bits_cache.clear()
+
+
+def compare(
+    result: dict,
+    baseline: typing.Optional[dict],
+    time_tolerance: float,
+    memory_tolerance: float,
+) -> typing.List[str]:
+    if baseline is None:
+        return []
+
+    problems = []
+    # times at the speed of the reference runs of the result
+    reference_seconds = result["seconds"] / result["relative_seconds"]
+    baseline_seconds = baseline["relative_seconds"] * reference_seconds
+    seconds_max = max(
+        baseline_seconds * (1 + time_tolerance), baseline_seconds + TIME_SLACK
+    )
+    if result["seconds"] > seconds_max:
+        problems.append(f"{result['seconds']:.4f}s, baseline {baseline_seconds:.4f}s")
+
+    peak_bytes_max = max(
+        baseline["peak_bytes"] * (1 + memory_tolerance),
+        baseline["peak_bytes"] + MEMORY_SLACK,
+    )
+    if result["peak_bytes"] > peak_bytes_max:
+        problems.append(
+            f"{result['peak_bytes']} bytes, baseline {baseline['peak_bytes']} bytes"
+        )
+    return problems
+
+
+def format_result(name, phase, result, baseline, problems) -> str:
+    line = (
+        f"{name:<14} {phase:<25} {result['seconds'] * 1000:10.2f} ms"
+        f" {result['peak_bytes'] / 1024:10.0f} KiB"
+    )
+    if baseline is not None:
+        ratio = result["relative_seconds"] / baseline["relative_seconds"]
+        line += f"  x{ratio:.2f} time"
+    if problems:
+        line += "  REGRESSION"
+    return line
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING)
+    sys.exit(main())
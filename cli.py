@@ -1,6 +1,7 @@
 import logging
 
 from mlscraper.samples import make_training_set
+from mlscraper.serialization import dumps_scraper
 from mlscraper.training import train_scraper
 from mlscraper.util import Page
 
@@ -29,6 +30,7 @@ def main():
     ts = make_training_set([page], [item])
     scraper = train_scraper(ts.item)
     print(scraper)
+    print(dumps_scraper(scraper))
 
 
 if __name__ == "__main__":
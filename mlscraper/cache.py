@@ -0,0 +1,184 @@
+"""
+On-disk cache of trained scrapers.
+
+Entries are keyed by a fingerprint of the training data and the search
+parameters, so training the same samples again returns the stored scraper.
+Several processes can share a cache directory: entries are written to a
+temporary file and renamed into place, readers only ever see whole entries.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import time
+import typing
+from pathlib import Path
+
+from mlscraper.samples import Item
+from mlscraper.scrapers import Scraper
+from mlscraper.serialization import (
+    FORMAT_VERSION,
+    SerializationException,
+    dumps_scraper,
+    loads_scraper,
+)
+from mlscraper.tracing import get_tracer
+
+# bytes stored at most per cache directory by default
+CACHE_SIZE_MAX = 64 * 1024 * 1024
+
+# seconds after which a temporary file is left over from an interrupted write
+TEMPORARY_AGE_MAX = 60 * 60
+
+_ENTRY_SUFFIX = ".json"
+_TEMPORARY_SUFFIX = ".tmp"
+
+
+def get_training_fingerprint(item: Item, search_parameters: dict) -> str:
+    """
+    Fingerprint of the pages and values of all samples and the search parameters.
+    """
+    fingerprint = hashlib.sha256()
+    fingerprint.update(
+        json.dumps(
+            {"format": FORMAT_VERSION, "parameters": search_parameters},
+            sort_keys=True,
+        ).encode()
+    )
+    for sample in item.samples:
+        html = sample.page.html
+        if isinstance(html, str):
+            html = html.encode()
+        page_hash = hashlib.sha256(html).hexdigest()
+        fingerprint.update(
+            json.dumps([page_hash, sample.value], sort_keys=True).encode()
+        )
+    return fingerprint.hexdigest()
+
+
+class ScraperCache:
+    """
+    Directory of serialized scrapers, evicting least recently used entries
+    once the total size exceeds max_size.
+
+    Temporary files of writes in progress count toward the size, the ones
+    older than TEMPORARY_AGE_MAX are left over from interrupted writes and
+    removed on eviction.
+    """
+
+    path = None
+    max_size = None
+    hits = None
+    misses = None
+
+    def __init__(self, path, max_size: int = CACHE_SIZE_MAX):
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, fingerprint: str) -> typing.Optional[Scraper]:
+        entry_path = self._get_entry_path(fingerprint)
+        try:
+            with open(entry_path, encoding="utf-8") as file:
+                scraper = loads_scraper(file.read())
+        except FileNotFoundError:
+            self.misses += 1
+            get_tracer().count("scraper cache misses")
+            return None
+        except SerializationException:
+            logging.warning(f"dropping unreadable cache entry {entry_path}")
+            self._remove(entry_path)
+            self.misses += 1
+            get_tracer().count("scraper cache misses")
+            return None
+
+        # modification time orders the entries for eviction
+        try:
+            os.utime(entry_path)
+        except FileNotFoundError:
+            pass
+        self.hits += 1
+        get_tracer().count("scraper cache hits")
+        return scraper
+
+    def put(self, fingerprint: str, scraper: Scraper):
+        data = dumps_scraper(scraper)
+        file_descriptor, temporary_path = tempfile.mkstemp(
+            dir=self.path, suffix=_TEMPORARY_SUFFIX
+        )
+        try:
+            with os.fdopen(file_descriptor, "w", encoding="utf-8") as file:
+                file.write(data)
+            os.replace(temporary_path, self._get_entry_path(fingerprint))
+        except BaseException:
+            self._remove(temporary_path)
+            raise
+
+        self.evict()
+
+    def evict(self):
+        """
+        Remove least recently used entries until the cache fits max_size.
+        """
+        size = self._remove_temporary_files()
+        entries = []
+        for entry_path in self.path.glob("*" + _ENTRY_SUFFIX):
+            try:
+                stat = entry_path.stat()
+            except FileNotFoundError:
+                # removed by another process
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry_path))
+
+        size += sum(entry_size for _, entry_size, _ in entries)
+        for _, entry_size, entry_path in sorted(entries):
+            if size <= self.max_size:
+                break
+            self._remove(entry_path)
+            size -= entry_size
+
+    def clear(self):
+        for entry_path in self.path.glob("*" + _ENTRY_SUFFIX):
+            self._remove(entry_path)
+        self._remove_temporary_files()
+
+    def _remove_temporary_files(self) -> int:
+        """
+        Remove temporary files left over from interrupted writes.
+
+        :return: size of the temporary files of writes still in progress
+        """
+        size = 0
+        now = time.time()
+        for temporary_path in self.path.glob("*" + _TEMPORARY_SUFFIX):
+            try:
+                stat = temporary_path.stat()
+            except FileNotFoundError:
+                # renamed into place or removed by another process
+                continue
+            if now - stat.st_mtime > TEMPORARY_AGE_MAX:
+                logging.info(f"removing left over temporary file {temporary_path}")
+                self._remove(temporary_path)
+            else:
+                size += stat.st_size
+        return size
+
+    def _get_entry_path(self, fingerprint: str) -> Path:
+        return self.path / (fingerprint + _ENTRY_SUFFIX)
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def __len__(self):
+        return sum(1 for _ in self.path.glob("*" + _ENTRY_SUFFIX))
+
+    def __repr__(self):
+        return f"<{self.__class__.__name__} {self.path=} {self.hits=} {self.misses=}>"
@@ -0,0 +1,229 @@
+"""
+Streaming readers for corpora of HTML documents.
+
+All readers yield (url, page) pairs one document at a time, so memory stays
+constant regardless of the corpus size. With parse=False they yield the raw
+HTML instead, e.g. to feed Scraper.scrape_iter.
+"""
+
+import gzip
+import json
+import logging
+import os
+import typing
+import zlib
+from pathlib import Path
+
+from mlscraper.util import Page
+
+READ_BUFFER_SIZE = 1 << 20
+
+HTML_CONTENT_TYPES = ("text/html", "application/xhtml+xml")
+
+
+class CorpusFormatException(Exception):
+    pass
+
+
+def read_corpus(path, parse: bool = True) -> typing.Generator:
+    """
+    Read a directory, JSON lines or WARC file, depending on the path.
+    """
+    path = Path(path)
+    if path.is_dir():
+        return read_directory(path, parse=parse)
+
+    suffixes = [s for s in path.suffixes if s != ".gz"]
+    if suffixes and suffixes[-1] in (".jsonl", ".ndjson"):
+        return read_jsonl(path, parse=parse)
+    if suffixes and suffixes[-1] == ".warc":
+        return read_warc(path, parse=parse)
+
+    raise CorpusFormatException(f"unknown corpus format: {path}")
+
+
+def read_directory(
+    path,
+    pattern: str = "**/*.html",
+    parse: bool = True,
+    encoding: typing.Optional[str] = None,
+) -> typing.Generator:
+    """
+    Read all files matching pattern below path, the url is the file uri.
+
+    :param encoding: encoding of the files, if None the bytes are kept
+        and the parser detects the charset of each document
+    """
+    for file_path in sorted(Path(path).glob(pattern)):
+        if not file_path.is_file():
+            continue
+
+        html = file_path.read_bytes()
+        if encoding:
+            html = html.decode(encoding, errors="replace")
+        yield _make_document(file_path.resolve().as_uri(), html, parse)
+
+
+def read_jsonl(
+    path, url_key: str = "url", html_key: str = "html", parse: bool = True
+) -> typing.Generator:
+    """
+    Read one JSON object per line, gzip compressed if the name ends with .gz.
+    """
+    with _open_binary(path) as file:
+        for line_number, line in enumerate(file, start=1):
+            if not line.strip():
+                continue
+
+            try:
+                document = json.loads(line)
+            except json.JSONDecodeError as e:
+                raise CorpusFormatException(f"{path}:{line_number}: {e}") from e
+
+            if not isinstance(document, dict):
+                raise CorpusFormatException(
+                    f"{path}:{line_number}: expected an object, got {type(document).__name__}"
+                )
+            if html_key not in document:
+                raise CorpusFormatException(
+                    f"{path}:{line_number}: missing key {html_key!r}"
+                )
+
+            yield _make_document(document.get(url_key), document[html_key], parse)
+
+
+def read_warc(path, parse: bool = True) -> typing.Generator:
+    """
+    Read the HTML responses of a WARC file, gzip compressed if the name ends with .gz.
+
+    Records are read one by one: headers line by line, the payload with a single
+    read of its content length. Other record types and non-HTML responses are skipped.
+    """
+    with _open_binary(path) as file:
+        while True:
+            headers = _read_warc_headers(file)
+            if headers is None:
+                return
+
+            try:
+                content_length = int(headers["content-length"])
+            except (KeyError, ValueError) as e:
+                raise CorpusFormatException(f"invalid content length in {path}") from e
+
+            block = file.read(content_length)
+            if len(block) < content_length:
+                raise CorpusFormatException(f"truncated record in {path}")
+
+            if headers.get("warc-type") != "response":
+                continue
+            if not headers.get("content-type", "").startswith("application/http"):
+                continue
+
+            html = _get_html_of_http_response(block)
+            if html is None:
+                continue
+
+            yield _make_document(headers.get("warc-target-uri"), html, parse)
+
+
+def _make_document(url, html: typing.Union[str, bytes], parse: bool):
+    if parse:
+        return url, Page(html)
+    return url, html
+
+
+def _open_binary(path):
+    if os.fspath(path).endswith(".gz"):
+        # gzip handles files of concatenated members, e.g. one per WARC record
+        return gzip.open(path, "rb")
+    return open(path, "rb", buffering=READ_BUFFER_SIZE)
+
+
+def _read_warc_headers(file) -> typing.Optional[typing.Dict[str, str]]:
+    """
+    Read the version line and headers of the next record, None at the end.
+    """
+    line = file.readline()
+    # records are separated by empty lines
+    while line in (b"\r\n", b"\n"):
+        line = file.readline()
+    if not line:
+        return None
+
+    if not line.startswith(b"WARC/"):
+        raise CorpusFormatException(f"expected WARC record, got {line[:50]!r}")
+
+    return _parse_headers(iter(file.readline, b""))
+
+
+def _parse_headers(lines: typing.Iterator[bytes]) -> typing.Dict[str, str]:
+    headers = {}
+    for line in lines:
+        line = line.rstrip(b"\r\n")
+        if not line:
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+    return headers
+
+
+def _get_html_of_http_response(block: bytes) -> typing.Optional[str]:
+    """
+    Decoded body of an HTTP response or None if it's not HTML.
+    """
+    head, _, body = block.partition(b"\r\n\r\n")
+    status_line, *header_lines = head.split(b"\r\n")
+    headers = _parse_headers(iter(header_lines))
+
+    content_type = headers.get("content-type", "").lower()
+    if not content_type.startswith(HTML_CONTENT_TYPES):
+        logging.info(f"skipping response of type {content_type}: {status_line}")
+        return None
+
+    if "chunked" in headers.get("transfer-encoding", "").lower():
+        try:
+            body = _decode_chunked(body)
+        except ValueError:
+            logging.warning(f"invalid chunked body, skipping: {status_line}")
+            return None
+
+    content_encoding = headers.get("content-encoding", "").lower()
+    try:
+        if content_encoding in ("gzip", "x-gzip"):
+            body = gzip.decompress(body)
+        elif content_encoding == "deflate":
+            body = zlib.decompress(body)
+    except (OSError, zlib.error):
+        logging.warning(f"could not decode {content_encoding} body, skipping")
+        return None
+
+    charset = "utf-8"
+    for parameter in content_type.split(";")[1:]:
+        key, _, value = parameter.partition("=")
+        if key.strip() == "charset" and value.strip():
+            charset = value.strip().strip('"')
+
+    try:
+        return body.decode(charset, errors="replace")
+    except LookupError:
+        return body.decode("utf-8", errors="replace")
+
+
+def _decode_chunked(body: bytes) -> bytes:
+    """
+    Body of a chunked transfer, raises ValueError on an invalid chunk size.
+    """
+    chunks = []
+    position = 0
+    while position < len(body):
+        line_end = body.find(b"\r\n", position)
+        if line_end < 0:
+            break
+        size = int(body[position:line_end].split(b";")[0] or b"0", 16)
+        if size == 0:
+            break
+        chunk_start = line_end + 2
+        chunk_end = chunk_start + size
+        chunks.append(body[chunk_start:chunk_end])
+        position = chunk_end + 2
+    return b"".join(chunks)
@@ -0,0 +1,248 @@
+"""
+Fast evaluation of the CSS path selectors generated during training.
+
+Generated selectors are compound selectors of a tag, ids, classes,
+:nth-child and :nth-of-type joined by descendant combinators,
+e.g. "div.answer :nth-child(2) a". This subset is matched against per-page
+posting lists and the structural arrays of the page instead of soupsieve.
+Everything else is left to soupsieve.
+"""
+
+import re
+import typing
+from bisect import bisect_left, bisect_right
+from collections import namedtuple
+from functools import lru_cache
+
+Compound = namedtuple(
+    "Compound", ["tag", "ids", "classes", "child_positions", "type_positions"]
+)
+
+# css identifiers, with non-ascii characters and escapes like soupsieve
+_ESCAPE = r"\\(?:[0-9a-fA-F]{1,6}[ \t\n\r\f]?|[^\n\r\f0-9a-fA-F])"
+_NAME_START = rf"(?:[_a-zA-Z]|[^\x00-\x7f]|{_ESCAPE})"
+_NAME_CHAR = rf"(?:[_a-zA-Z0-9-]|[^\x00-\x7f]|{_ESCAPE})"
+_IDENT = rf"(?:--|-?{_NAME_START}){_NAME_CHAR}*"
+_UNESCAPE_RE = re.compile(
+    r"\\(?:(?P<code_point>[0-9a-fA-F]{1,6})[ \t\n\r\f]?|(?P<char>[^\n\r\f0-9a-fA-F]))"
+)
+_TAG_RE = re.compile(r"[a-zA-Z][a-zA-Z0-9-]*")
+_PART_RE = re.compile(
+    rf"#(?P<id>{_IDENT})|\.(?P<class>{_IDENT})"
+    r"|:nth-child\((?P<child>[0-9]+)\)|:nth-of-type\((?P<type>[0-9]+)\)"
+)
+_WHITESPACE_RE = re.compile(r"[ \t\n\r\f]+")
+
+
+@lru_cache(maxsize=16384)
+def parse_path_selector(
+    css_selector: str,
+) -> typing.Optional[typing.Tuple[Compound, ...]]:
+    """
+    Parse a path selector into its compounds (top to bottom) or None if the
+    selector is not part of the supported subset.
+    """
+    # escapes can end with whitespace, so compounds are parsed in sequence
+    compounds = []
+    position = _skip_whitespace(css_selector, 0)
+    while position < len(css_selector):
+        compound, end = _parse_compound(css_selector, position)
+        if compound is None:
+            return None
+        compounds.append(compound)
+
+        position = _skip_whitespace(css_selector, end)
+
+    if not compounds:
+        return None
+    return tuple(compounds)
+
+
+def _skip_whitespace(css_selector: str, position: int) -> int:
+    whitespace_match = _WHITESPACE_RE.match(css_selector, position)
+    return whitespace_match.end() if whitespace_match else position
+
+
+def _parse_compound(
+    css_selector: str, start: int
+) -> typing.Tuple[typing.Optional[Compound], int]:
+    tag = None
+    tag_match = _TAG_RE.match(css_selector, start)
+    if tag_match:
+        tag = tag_match.group().lower()
+
+    ids, classes, child_positions, type_positions = [], [], [], []
+    position = tag_match.end() if tag_match else start
+    while position < len(css_selector) and not _WHITESPACE_RE.match(
+        css_selector, position
+    ):
+        part_match = _PART_RE.match(css_selector, position)
+        if not part_match:
+            return None, position
+
+        if part_match.group("id"):
+            ids.append(_unescape(part_match.group("id")))
+        elif part_match.group("class"):
+            classes.append(_unescape(part_match.group("class")))
+        elif part_match.group("child"):
+            child_positions.append(int(part_match.group("child")))
+        else:
+            type_positions.append(int(part_match.group("type")))
+        position = part_match.end()
+
+    if position == start:
+        return None, position
+
+    compound = Compound(
+        tag, tuple(ids), tuple(classes), tuple(child_positions), tuple(type_positions)
+    )
+    return compound, position
+
+
+def _unescape(identifier: str) -> str:
+    return _UNESCAPE_RE.sub(_replace_escape, identifier)
+
+
+def _replace_escape(escape_match) -> str:
+    if escape_match.group("char") is not None:
+        return escape_match.group("char")
+
+    code_point = int(escape_match.group("code_point"), 16)
+    if code_point == 0 or 0xD800 <= code_point <= 0xDFFF or code_point > 0x10FFFF:
+        return "\ufffd"
+    return chr(code_point)
+
+
+class PathSelectorIndex:
+    """
+    Posting lists of a page: element ids in document order per tag, class and id.
+    """
+
+    def __init__(self, page):
+        # only the arrays are kept, the page owns the index
+        self.parents = page._parents
+        self.subtree_ends = page._subtree_ends
+        self.child_positions = page._child_positions
+        self.type_positions = page._type_positions
+
+        self.names = [None]
+        self.ids_per_tag = {}
+        self.ids_per_class = {}
+        self.ids_per_id = {}
+        self.classes = [()]
+        self.tag_ids = [None]
+        self.ids_per_child_position = {}
+        self.ids_per_type_position = {}
+        self._matching_ids_per_compound = {}
+
+        for node_id in range(1, page.get_node_count()):
+            soup = page._soups[node_id]
+
+            name = soup.name.lower()
+            self.names.append(name)
+            self.ids_per_tag.setdefault(name, []).append(node_id)
+
+            css_classes = soup.attrs.get("class", ())
+            if isinstance(css_classes, str):
+                css_classes = css_classes.split()
+            css_classes = tuple(css_classes)
+            self.classes.append(css_classes)
+            for css_class in set(css_classes):
+                self.ids_per_class.setdefault(css_class, []).append(node_id)
+
+            tag_id = soup.attrs.get("id")
+            self.tag_ids.append(tag_id)
+            if isinstance(tag_id, str):
+                self.ids_per_id.setdefault(tag_id, []).append(node_id)
+
+            self.ids_per_child_position.setdefault(
+                self.child_positions[node_id], []
+            ).append(node_id)
+            self.ids_per_type_position.setdefault(
+                self.type_positions[node_id], []
+            ).append(node_id)
+
+    def select_ids(
+        self, root_id: int, compounds: typing.Tuple[Compound, ...]
+    ) -> typing.List[int]:
+        """
+        Ids of all descendants of root matching the path, in document order.
+
+        Like soupsieve, ancestors may lie above the root, the document never matches.
+        """
+        parents = self.parents
+        *ancestor_compounds, compound = compounds
+        ancestor_id_sets = [
+            self._get_matching_ids(c)[1] for c in reversed(ancestor_compounds)
+        ]
+
+        node_ids = self._get_matching_ids(compound)[0]
+        first = bisect_left(node_ids, root_id + 1)
+        last = bisect_right(node_ids, self.subtree_ends[root_id])
+
+        selected = []
+        for node_id in node_ids[first:last]:
+            # match ancestors greedily from the bottom up
+            ancestor_id = parents[node_id]
+            for ancestor_ids in ancestor_id_sets:
+                while ancestor_id > 0 and ancestor_id not in ancestor_ids:
+                    ancestor_id = parents[ancestor_id]
+                if ancestor_id <= 0:
+                    break
+                ancestor_id = parents[ancestor_id]
+            else:
+                selected.append(node_id)
+        return selected
+
+    def _get_matching_ids(
+        self, compound: Compound
+    ) -> typing.Tuple[typing.List[int], typing.FrozenSet[int]]:
+        """
+        All ids of the page matching the compound, as sorted list and as set.
+        """
+        if compound not in self._matching_ids_per_compound:
+            node_ids = [
+                node_id
+                for node_id in self._get_candidates(compound)
+                if self.matches(node_id, compound)
+            ]
+            self._matching_ids_per_compound[compound] = (node_ids, frozenset(node_ids))
+        return self._matching_ids_per_compound[compound]
+
+    def _get_candidates(self, compound: Compound):
+        posting_lists = [self.ids_per_id.get(i, ()) for i in compound.ids]
+        posting_lists += [self.ids_per_class.get(c, ()) for c in compound.classes]
+        if compound.tag is not None:
+            posting_lists.append(self.ids_per_tag.get(compound.tag, ()))
+        posting_lists += [
+            self.ids_per_child_position.get(p, ()) for p in compound.child_positions
+        ]
+        posting_lists += [
+            self.ids_per_type_position.get(p, ()) for p in compound.type_positions
+        ]
+
+        if not posting_lists:
+            return range(1, len(self.names))
+
+        # the shortest list has the fewest candidates, the rest is checked per node
+        return min(posting_lists, key=len)
+
+    def matches(self, node_id: int, compound: Compound) -> bool:
+        if compound.tag is not None and self.names[node_id] != compound.tag:
+            return False
+
+        if any(self.tag_ids[node_id] != i for i in compound.ids):
+            return False
+
+        if any(c not in self.classes[node_id] for c in compound.classes):
+            return False
+
+        child_position = self.child_positions[node_id]
+        if any(p != child_position for p in compound.child_positions):
+            return False
+
+        type_position = self.type_positions[node_id]
+        if any(p != type_position for p in compound.type_positions):
+            return False
+
+        return True
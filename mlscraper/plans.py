@@ -0,0 +1,176 @@
+"""
+Compiled execution plans for trained scrapers.
+
+A trained scraper tree runs one CSS selection per key and list item. A plan
+selects each rule once, with the path selector index and node ids of the
+page, the rules of list items below the common ancestor of all items. Keys
+and list items are then resolved from the selected ids: the descendants of
+node i are the nodes i+1 up to the end of its subtree.
+"""
+
+import typing
+from bisect import bisect_right
+
+from mlscraper.css import parse_path_selector
+from mlscraper.scrapers import DictScraper, ListScraper, Scraper, ValueScraper
+from mlscraper.util import Node, Page
+
+
+class PlanCompilationException(Exception):
+    pass
+
+
+class ScrapePlan:
+    """
+    Plan to scrape a page with one selection per rule.
+    """
+
+    scraper = None
+
+    def __init__(self, scraper: Scraper):
+        self.scraper = scraper
+
+        # unique css rules of the scraper tree
+        self.css_rules = []
+        self.step = self._compile(scraper)
+
+    def _compile(self, scraper: Scraper):
+        if isinstance(scraper, DictScraper):
+            return _DictStep(
+                {k: self._compile(s) for k, s in scraper.scraper_per_key.items()}
+            )
+
+        if isinstance(scraper, ListScraper):
+            return _ListStep(
+                self._get_rule_index(scraper.selector), self._compile(scraper.scraper)
+            )
+
+        if isinstance(scraper, ValueScraper):
+            return _ValueStep(self._get_rule_index(scraper.selector), scraper.extractor)
+
+        raise PlanCompilationException(f"unsupported scraper: {scraper}")
+
+    def _get_rule_index(self, selector) -> int:
+        css_rule = getattr(selector, "css_rule", None)
+        if not isinstance(css_rule, str):
+            raise PlanCompilationException(f"selector has no css rule: {selector}")
+
+        # :scope depends on the element select is called on, not on the page
+        if ":scope" in css_rule:
+            raise PlanCompilationException(f"scope-relative rule: {css_rule}")
+
+        if css_rule not in self.css_rules:
+            self.css_rules.append(css_rule)
+        return self.css_rules.index(css_rule)
+
+    def get(self, node: Node):
+        if not isinstance(node.page, Page):
+            # only soup pages have an index, everything else uses the scraper tree
+            return self.scraper.get(node)
+
+        selection = _PageSelection(node.page, self.css_rules)
+        return self.step.get(selection, node.node_id, node.node_id)
+
+    def __repr__(self):
+        return f"<{self.__class__.__name__} {self.css_rules=}>"
+
+
+class _PageSelection:
+    """
+    Matches of the rules of a plan on one page, as node ids in document order.
+
+    Rules are selected once below a root and the matches of a scope inside the
+    root are a range of them. Like soupsieve, ancestors in a rule may lie above
+    the root, so the matches below the root are all matches in its subtree.
+    """
+
+    def __init__(self, page: Page, css_rules: typing.List[str]):
+        self.page = page
+        self.css_rules = css_rules
+        self._matches_per_rule_and_root = {}
+
+    def _get_matches(self, rule_index, root) -> typing.List[int]:
+        key = (rule_index, root)
+        if key not in self._matches_per_rule_and_root:
+            css_rule = self.css_rules[rule_index]
+            compounds = parse_path_selector(css_rule)
+            if compounds is not None:
+                index = self.page.get_path_selector_index()
+                matches = index.select_ids(root, compounds)
+            else:
+                root_node = self.page.get_node_by_id(root)
+                matches = [node.node_id for node in root_node.select(css_rule)]
+            self._matches_per_rule_and_root[key] = matches
+        return self._matches_per_rule_and_root[key]
+
+    def select_all(self, rule_index, scope, root) -> typing.List[int]:
+        matches = self._get_matches(rule_index, root)
+        start = bisect_right(matches, scope)
+        end = bisect_right(matches, self.page.get_subtree_end(scope), start)
+        return matches[start:end]
+
+    def select_one(self, rule_index, scope, root) -> int:
+        matches = self._get_matches(rule_index, root)
+        i = bisect_right(matches, scope)
+        if i == len(matches) or matches[i] > self.page.get_subtree_end(scope):
+            # same error as indexing an empty select result
+            raise IndexError("list index out of range")
+        return matches[i]
+
+    def get_common_ancestor(self, node_ids: typing.List[int]) -> int:
+        # ids are in document order, the ancestor of the first containing the last
+        # is the one of all, without the range query tables training builds
+        ancestor_id = node_ids[0]
+        while ancestor_id > 0 and not self.page.is_ancestor(ancestor_id, node_ids[-1]):
+            ancestor_id = self.page.get_parent_id(ancestor_id)
+        return ancestor_id
+
+    def get_node(self, node_id) -> Node:
+        return self.page.get_node_by_id(node_id)
+
+
+# steps select below scope, with the rules matched once below root
+
+
+class _DictStep:
+    def __init__(self, step_per_key):
+        self.step_per_key = step_per_key
+
+    def get(self, selection: _PageSelection, scope: int, root: int):
+        return {
+            key: step.get(selection, scope, root)
+            for key, step in self.step_per_key.items()
+        }
+
+
+class _ListStep:
+    def __init__(self, rule_index, step):
+        self.rule_index = rule_index
+        self.step = step
+
+    def get(self, selection: _PageSelection, scope: int, root: int):
+        item_ids = selection.select_all(self.rule_index, scope, root)
+        if not item_ids:
+            return []
+
+        # rules of the items are matched once below their common ancestor
+        item_root = selection.get_common_ancestor(item_ids)
+        return [self.step.get(selection, i, item_root) for i in item_ids]
+
+
+class _ValueStep:
+    def __init__(self, rule_index, extractor):
+        self.rule_index = rule_index
+        self.extractor = extractor
+
+    def get(self, selection: _PageSelection, scope: int, root: int):
+        node = selection.get_node(selection.select_one(self.rule_index, scope, root))
+        return self.extractor.extract(node)
+
+
+def compile_scraper(scraper: Scraper) -> ScrapePlan:
+    """
+    Compile a trained scraper into a plan that returns the same results as
+    scraper.get but selects each rule only once per page.
+    """
+    return ScrapePlan(scraper)
@@ -1,7 +1,17 @@
 import typing
 from itertools import product
 
-from mlscraper.util import DictMatch, ListMatch, Page
+from mlscraper.util import (
+    DictMatch,
+    ListMatch,
+    LRUCache,
+    Match,
+    Page,
+)
+
+# matches per (page, value) of value samples, shared by all samples of a
+# training run and cleared when it ends, see mlscraper.training
+match_cache = LRUCache(maxsize=1024, name="match cache")
 
 
 class ItemStructureException(Exception):
@@ -17,33 +27,59 @@ class Sample:
         return f"<{self.__class__.__name__} {self.page=}, {self.value=}>"
 
     def get_matches(self):
+        """
+        Get all matches of the sample on its page.
+
+        Matches of values are cached in match_cache, callers must not modify them.
+        Combinations of lists and dicts are built anew, see generate_matches.
+        """
+        if isinstance(self.value, str):
+            return match_cache.get_or_compute(
+                (self.page, self.value), lambda: self.page.find_all(self.value)
+            )
+
+        return list(self.generate_matches())
+
+    def generate_matches(self) -> typing.Generator:
+        """
+        Generate the matches of the sample lazily, in the order of get_matches.
+
+        Combinations are built one at a time, so callers can stop after the
+        first usable one without holding the whole product in memory.
+        """
         # todo: fix creating new sample objects, maybe by using Item class?
 
         if isinstance(self.value, str):
-            return self.page.find_all(self.value)
+            yield from self.get_matches()
+            return
 
         if isinstance(self.value, list):
             matches_by_value = [Sample(self.page, v).get_matches() for v in self.value]
 
-            # generate list of combinations
-            # todo filter combinations that use the same matches twice
-            match_combis = product(*matches_by_value)
-
-            return [ListMatch(tuple(match_combi)) for match_combi in match_combis]
+            # list items are distinct nodes, so combinations using a node twice are skipped
+            for match_combi in product(*matches_by_value):
+                if _has_distinct_roots(match_combi):
+                    yield ListMatch(match_combi)
+            return
 
         if isinstance(self.value, dict):
-            matches_by_key = {
-                k: Sample(self.page, self.value[k]).get_matches() for k in self.value
-            }
-
-            return [
-                DictMatch(dict(zip(matches_by_key.keys(), mc)))
-                for mc in product(*matches_by_key.values())
+            keys = tuple(self.value)
+            matches_per_key = [
+                Sample(self.page, self.value[k]).get_matches() for k in keys
             ]
 
+            for match_combi in product(*matches_per_key):
+                yield DictMatch.from_combination(keys, match_combi)
+            return
+
         raise RuntimeError(f"unsupported value: {self.value}")
 
 
+def _has_distinct_roots(matches: typing.Iterable[Match]) -> bool:
+    roots = [m.get_root() for m in matches]
+    return len(set(roots)) == len(roots)
+
+
 class TrainingSet:
     """
     Class containing samples for all pages.
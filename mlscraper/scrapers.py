@@ -1,12 +1,82 @@
+import os
 import typing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 
-from mlscraper.util import Extractor, Node, Selector
+from mlscraper.util import Extractor, Node, Selector, parse_page
 
 
 class Scraper:
     def get(self, node: Node):
         raise NotImplementedError()
 
+    def get_required_rules(self) -> typing.Optional[typing.List[str]]:
+        """
+        CSS rules whose first match on a page settles this scraper.
+
+        None if the scraper needs the whole page.
+        """
+        return None
+
+    def get_many(
+        self,
+        htmls: typing.Iterable[str],
+        n_jobs: int = -1,
+        max_in_flight: typing.Optional[int] = None,
+        backend: str = "soup",
+        partial: bool = False,
+    ) -> list:
+        """
+        Scrape raw HTML documents, see scrape_iter.
+        """
+        return list(self.scrape_iter(htmls, n_jobs, max_in_flight, backend, partial))
+
+    def scrape_iter(
+        self,
+        htmls: typing.Iterable[str],
+        n_jobs: int = -1,
+        max_in_flight: typing.Optional[int] = None,
+        backend: str = "soup",
+        partial: bool = False,
+    ) -> typing.Generator:
+        """
+        Parse and scrape raw HTML documents in a process pool.
+
+        Each worker loads the scraper once. Results are yielded in input order
+        and at most max_in_flight documents are submitted but not yet yielded,
+        so htmls can be a lazy stream of any length.
+        :param htmls: raw HTML documents
+        :param n_jobs: number of worker processes, -1 for all cores, 1 to run here
+        :param max_in_flight: documents in flight at most, twice the workers if None
+        :param backend: page backend, "lxml" is faster and uses less memory
+        :param partial: parse lxml pages only until the required rules are settled
+        """
+        if partial and backend != "lxml":
+            raise ValueError("partial parsing needs the lxml backend")
+        required_rules = self.get_required_rules() if partial else None
+
+        if n_jobs < 0:
+            n_jobs = os.cpu_count()
+        if n_jobs == 1:
+            for html in htmls:
+                yield self.get(parse_page(html, backend, required_rules))
+            return
+
+        max_in_flight = max_in_flight or 2 * n_jobs
+        with ProcessPoolExecutor(
+            n_jobs,
+            initializer=_init_scrape_worker,
+            initargs=(self, backend, required_rules),
+        ) as executor:
+            futures = deque()
+            for html in htmls:
+                if len(futures) >= max_in_flight:
+                    yield futures.popleft().result()
+                futures.append(executor.submit(_scrape_in_worker, html))
+
+            while futures:
+                yield futures.popleft().result()
+
 
 class DictScraper(Scraper):
     scraper_per_key = None
@@ -17,6 +87,15 @@ class DictScraper(Scraper):
     def get(self, node: Node):
         return {key: scraper.get(node) for key, scraper in self.scraper_per_key.items()}
 
+    def get_required_rules(self):
+        required_rules = []
+        for scraper in self.scraper_per_key.values():
+            rules = scraper.get_required_rules()
+            if rules is None:
+                return None
+            required_rules += rules
+        return required_rules
+
     def __repr__(self):
         return f"<DictScraper {self.scraper_per_key=}>"
 
@@ -34,6 +113,10 @@ class ListScraper(Scraper):
             self.scraper.get(item_node) for item_node in self.selector.select_all(node)
         ]
 
+    def get_required_rules(self):
+        # more items can follow until the end of the page
+        return None
+
     def __repr__(self):
         return f"<ListScraper {self.scraper=}>"
 
@@ -49,5 +132,33 @@ class ValueScraper(Scraper):
     def get(self, node: Node):
         return self.extractor.extract(self.selector.select_one(node))
 
+    def get_required_rules(self):
+        # the value is the first match, settled once that element is complete
+        css_rule = getattr(self.selector, "css_rule", None)
+        if isinstance(css_rule, str):
+            return [css_rule]
+        return None
+
     def __repr__(self):
         return f"<ValueScraper {self.selector=}, {self.extractor=}>"
+
+
+# scraper and parse options of a worker process, set once by the pool initializer
+_worker_scraper = None
+_worker_backend = None
+_worker_required_rules = None
+
+
+def _init_scrape_worker(scraper: Scraper, backend: str, required_rules):
+    global _worker_scraper, _worker_backend, _worker_required_rules
+
+    # pages are parsed once per scrape, so the scraper tree is as fast as a plan
+    _worker_scraper = scraper
+    _worker_backend = backend
+    _worker_required_rules = required_rules
+
+
+def _scrape_in_worker(html: str):
+    return _worker_scraper.get(
+        parse_page(html, _worker_backend, _worker_required_rules)
+    )
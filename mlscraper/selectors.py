@@ -1,75 +1,382 @@
+import functools
+import inspect
 import logging
+import time
 import typing
-from itertools import product
+from contextlib import contextmanager
+from heapq import heappop, heappush
+from itertools import count
 
-from more_itertools import flatten
+from soupsieve import SelectorSyntaxError
 
-from mlscraper.samples import Sample
-from mlscraper.util import Matcher, Node, Page, Selector
+from mlscraper.samples import Sample, match_cache
+from mlscraper.tracing import get_tracer
+from mlscraper.util import (
+    PARENT_NODE_COUNT_MAX,
+    CssRuleSelector,
+    LRUCache,
+    Match,
+    Matcher,
+    Node,
+    count_nodes,
+    generate_node_ids,
+    generate_node_selector,
+    get_node_bits,
+)
 
+# default number of candidate selectors evaluated per search
+CANDIDATES_EVALUATED_MAX = 5000
 
-class CssRuleSelector(Selector):
-    def __init__(self, css_rule):
-        self.css_rule = css_rule
+# nodes selected per (root, css selector) as bitsets of node ids,
+# shared by all searches of a training run
+selection_bits_cache = LRUCache(maxsize=16384, name="selection bits cache")
 
-    def select_one(self, page: Page):
-        return page.select(self.css_rule)[0]
+# searches in progress, nested ones included
+_search_depth = 0
 
-    def select_all(self, page):
-        return page.select(self.css_rule)
+# outcome of evaluating a candidate selector
+SELECTOR_MATCHES = "matches"
+SELECTOR_TOO_BROAD = "too broad"
+SELECTOR_FAILS = "fails"
+
+
+class SearchBudgetExhaustedException(Exception):
+    """
+    Raised when a training run used up its budget, reports how far it got.
+    """
+
+    def __init__(self, seconds, candidates_evaluated, items_trained=0, item_path=()):
+        super().__init__(seconds, candidates_evaluated, items_trained, item_path)
+        self.seconds = seconds
+        self.candidates_evaluated = candidates_evaluated
+        self.items_trained = items_trained
+        # keys and list levels down to the item in training, filled while unwinding
+        self.item_path = list(item_path)
+
+    def __reduce__(self):
+        return self.__class__, (
+            self.seconds,
+            self.candidates_evaluated,
+            self.items_trained,
+            tuple(self.item_path),
+        )
+
+    def __str__(self):
+        return (
+            f"budget exhausted after {self.seconds:.2f}s and"
+            f" {self.candidates_evaluated} candidates, {self.items_trained} items"
+            f" trained, stopped at {'/'.join(map(str, self.item_path)) or 'root'}"
+        )
+
+
+class SearchBudget:
+    """
+    Time and candidates that all searches of one training run may use together.
+
+    Forked workers get a copy: the deadline holds for all of them, candidates
+    are counted together while shared, items trained by workers are not counted.
+    """
+
+    started = None
+    deadline = None
+    max_candidates = None
+    candidates_evaluated = None
+    items_trained = None
+    # counter in shared memory while workers are forked, see share_candidates
+    _shared_candidates = None
+
+    def __init__(
+        self,
+        timeout: typing.Optional[float] = None,
+        max_candidates: typing.Optional[int] = None,
+    ):
+        """
+        :param timeout: seconds from now until searches stop
+        :param max_candidates: candidates to evaluate at most over all searches
+        """
+        self.started = time.monotonic()
+        if timeout is not None:
+            self.deadline = self.started + timeout
+        self.max_candidates = max_candidates
+        self.candidates_evaluated = 0
+        self.items_trained = 0
+
+    def check(self):
+        """
+        Raise SearchBudgetExhaustedException if the time is up.
+        """
+        if self.deadline is not None and time.monotonic() >= self.deadline:
+            raise self._make_exception()
+
+    def spend_candidate(self):
+        """
+        Account for one more candidate or raise if the budget does not allow it.
+        """
+        if self._shared_candidates is None:
+            self._spend_candidate()
+            return
+
+        with self._shared_candidates.get_lock():
+            self.candidates_evaluated = self._shared_candidates.value
+            try:
+                self._spend_candidate()
+            finally:
+                self._shared_candidates.value = self.candidates_evaluated
+
+    def _spend_candidate(self):
+        if (
+            self.max_candidates is not None
+            and self.candidates_evaluated >= self.max_candidates
+        ):
+            raise self._make_exception()
+        self.check()
+        self.candidates_evaluated += 1
+
+    def share_candidates(self, context):
+        """
+        Count candidates in shared memory, for workers forked from context.
+        """
+        self._shared_candidates = context.Value("q", self.candidates_evaluated)
+
+    def unshare_candidates(self):
+        """
+        Take over the candidates counted by all workers and count locally again.
+        """
+        if self._shared_candidates is not None:
+            self.candidates_evaluated = self._shared_candidates.value
+            self._shared_candidates = None
+
+    def get_seconds(self) -> float:
+        return time.monotonic() - self.started
+
+    def _make_exception(self) -> SearchBudgetExhaustedException:
+        return SearchBudgetExhaustedException(
+            self.get_seconds(), self.candidates_evaluated, self.items_trained
+        )
 
     def __repr__(self):
-        return f"<{self.__class__.__name__} {self.css_rule=}>"
+        return (
+            f"<{self.__class__.__name__} {self.deadline=} {self.max_candidates=}"
+            f" {self.candidates_evaluated=}>"
+        )
 
 
-def generate_selector_for_nodes(nodes, roots):
+@contextmanager
+def search_scope():
+    """
+    Scope the caches of the search to the outermost search in progress.
+
+    Cached matches and selections hold nodes and thereby their pages,
+    so they are dropped once the outermost search returns.
+    """
+    global _search_depth
+
+    _search_depth += 1
+    try:
+        yield
+    finally:
+        _search_depth -= 1
+        if _search_depth == 0:
+            match_cache.clear()
+            selection_bits_cache.clear()
+
+
+def _in_search_scope(function):
+    """
+    Run function, or iterate the generator it returns, in a search_scope.
+    """
+    if inspect.isgeneratorfunction(function):
+
+        @functools.wraps(function)
+        def generator_wrapper(*args, **kwargs):
+            with search_scope():
+                yield from function(*args, **kwargs)
+
+        return generator_wrapper
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        with search_scope():
+            return function(*args, **kwargs)
+
+    return wrapper
+
+
+def select_node_bits(root: Node, css_selector: str) -> int:
+    """
+    Select nodes below root as bitset of their ids, memoized in selection_bits_cache.
+    """
+    return selection_bits_cache.get_or_compute(
+        (root, css_selector), lambda: root.select_bits(css_selector)
+    )
+
+
+@_in_search_scope
+def generate_selector_for_nodes(
+    nodes,
+    roots,
+    max_candidates: typing.Optional[int] = CANDIDATES_EVALUATED_MAX,
+    budget: typing.Optional[SearchBudget] = None,
+):
     if roots is None:
         logging.info("roots is None, setting roots manually")
         roots = [n.get_root() for n in nodes]
 
-    nodes_per_root = {}
-    for root in set(roots):
-        nodes_per_root[root] = {n for n, r in zip(nodes, roots) if r == root}
+    # node sets are compared as bitsets of the node ids of their pages
+    node_ids_per_root = {}
+    for node, root in zip(nodes, roots):
+        node_ids_per_root.setdefault(root, []).append(node.node_id)
+    bits_per_root = [
+        (root, get_node_bits(node_ids)) for root, node_ids in node_ids_per_root.items()
+    ]
+
+    def evaluate(sel):
+        selected_bits_per_root = [
+            (select_node_bits(root, sel), bits) for root, bits in bits_per_root
+        ]
+        if all(selected == bits for selected, bits in selected_bits_per_root):
+            return SELECTOR_MATCHES
+
+        logging.info(f"selector does not match nodes exactly: {sel}")
+        if all(selected & bits == bits for selected, bits in selected_bits_per_root):
+            return SELECTOR_TOO_BROAD
+        return SELECTOR_FAILS
 
-    selectors_seen = set()
+    for sel in search_path_selectors(nodes, evaluate, max_candidates, budget):
+        yield CssRuleSelector(sel)
 
+
+def search_path_selectors(
+    nodes: typing.List[Node],
+    evaluate: typing.Callable[[str], str],
+    max_candidates: typing.Optional[int] = CANDIDATES_EVALUATED_MAX,
+    budget: typing.Optional[SearchBudget] = None,
+) -> typing.Generator:
+    """
+    Best-first search for path selectors of the given nodes.
+
+    Paths are built from each node upwards, cheapest and most specific first.
+    evaluate rates each candidate: matching candidates are yielded, candidates
+    selecting too much get extended by an ancestor, and candidates not selecting
+    all targets are pruned, as extending a path only ever selects less.
+    :param nodes: nodes to start paths from
+    :param evaluate: returns SELECTOR_MATCHES, SELECTOR_TOO_BROAD or SELECTOR_FAILS
+    :param max_candidates: number of candidates to evaluate at most, None for all
+    :param budget: budget shared with other searches, raises once it is used up
+    """
+    tracer = get_tracer()
+    outcome_per_selector = {}
     for node in nodes:
-        for sel in node.generate_path_selectors():
-            if sel not in selectors_seen:
-                print([set(root.select(sel)) for root in nodes_per_root.keys()])
-                print([nodes_per_root[root] for root in nodes_per_root.keys()])
-                if all(
-                    set(root.select(sel)) == nodes_per_root[root]
-                    for root in nodes_per_root.keys()
+        path = node.get_selectable_path()
+        selectors_per_path_node = {}
+
+        def get_node_selectors(i):
+            # (weight, css) for every selector of the i-th node of the path
+            if i not in selectors_per_path_node:
+                soup, positions = path[i]
+                selectors_per_path_node[i] = [
+                    (_get_node_selector_weight(css), css)
+                    for css in generate_node_selector(soup, positions)
+                ]
+            return selectors_per_path_node[i]
+
+        # entries: (path length, weight, tie breaker, selectors bottom-up, path index)
+        tie_breaker = count()
+        heap = [
+            (1, w, next(tie_breaker), (css,), 0) for w, css in get_node_selectors(0)
+        ]
+        tracer.count("candidates generated", len(heap))
+        while heap:
+            length, weight, _, path_selectors, path_index = heappop(heap)
+            sel = " ".join(reversed(path_selectors))
+
+            if sel not in outcome_per_selector:
+                if max_candidates is not None and (
+                    len(outcome_per_selector) >= max_candidates
                 ):
-                    yield CssRuleSelector(sel)
-                else:
-                    logging.info(f"selector does not match nodes exactly: {sel}")
+                    logging.info(f"evaluated {max_candidates} candidates, stopping")
+                    return
 
-                # add to seen
-                selectors_seen.add(sel)
+                if budget is not None:
+                    budget.spend_candidate()
+                tracer.count("candidates evaluated")
+                try:
+                    outcome_per_selector[sel] = evaluate(sel)
+                except SelectorSyntaxError:
+                    # e.g. unescaped classes like md:w-auto
+                    logging.info(f"not a valid selector: {sel}")
+                    outcome_per_selector[sel] = SELECTOR_FAILS
+
+                if outcome_per_selector[sel] == SELECTOR_MATCHES:
+                    tracer.count("candidates matching")
+                    yield sel
             else:
                 logging.info(f"selector already checked: {sel}")
 
+            if outcome_per_selector[sel] == SELECTOR_FAILS:
+                continue
+
+            # paths can use up to PARENT_NODE_COUNT_MAX ancestors
+            if length > PARENT_NODE_COUNT_MAX:
+                continue
 
+            for i in range(path_index + 1, len(path)):
+                node_selectors = get_node_selectors(i)
+                tracer.count("candidates generated", len(node_selectors))
+                for w, css in node_selectors:
+                    heappush(
+                        heap,
+                        (
+                            length + 1,
+                            weight + w,
+                            next(tie_breaker),
+                            path_selectors + (css,),
+                            i,
+                        ),
+                    )
+
+
+def _get_node_selector_weight(css: str) -> int:
+    """
+    Expected cost of a node selector: ids are unique and cheap to look up,
+    classes are specific, bare tags and positions match many nodes.
+    """
+    if css.startswith("#"):
+        return 0
+    if css.startswith(":"):
+        return 3
+    if "." in css:
+        return 1
+    return 2
+
+
+@_in_search_scope
 def make_matcher_for_samples(
-    samples: typing.List[Sample], roots: typing.Optional[typing.List[Node]] = None
+    samples: typing.List[Sample],
+    roots: typing.Optional[typing.List[Node]] = None,
+    budget: typing.Optional[SearchBudget] = None,
 ) -> typing.Union[Matcher, None]:
     for sample in samples:
         assert sample.get_matches(), f"no matches found for {sample}"
 
-    for matcher in generate_matchers_for_samples(samples, roots):
+    for matcher in generate_matchers_for_samples(samples, roots, budget=budget):
         return matcher
     return None
 
 
+@_in_search_scope
 def generate_matchers_for_samples(
-    samples: typing.List[Sample], roots: typing.Optional[typing.List[Node]] = None
+    samples: typing.List[Sample],
+    roots: typing.Optional[typing.List[Node]] = None,
+    max_candidates: typing.Optional[int] = CANDIDATES_EVALUATED_MAX,
+    budget: typing.Optional[SearchBudget] = None,
 ) -> typing.Generator:
     """
     Generate CSS selectors that match the given samples.
     :param samples:
     :param roots: root nodes to search from
+    :param max_candidates: number of candidate selectors to evaluate at most
+    :param budget: budget shared with other searches
     :return:
     """
     logging.info(f"generating matchers for samples {samples}")
@@ -78,31 +385,211 @@ def generate_matchers_for_samples(
 
     assert len(samples) == len(roots)
 
-    # make a list containing sets of nodes for each possible combination of matches
-    # -> enables fast searching and set ensures order
+    # index which sample each node could stand for, per extractor
+    # -> candidate node sets are checked without building all combinations
     # todo add only matches below roots here
-    matches_per_sample = [s.get_matches() for s in samples]
-    match_combinations = list(map(set, product(*matches_per_sample)))
-    node_combinations = [
-        {m.get_root() for m in matches} for matches in match_combinations
+    combination_index = _MatchCombinationIndex([s.get_matches() for s in samples])
+
+    def evaluate(css_sel):
+        logging.info(f"testing selector: {css_sel}")
+        matched_bits = combination_index.select_bits(roots, css_sel)
+        if combination_index.get_extractor(matched_bits) is not None:
+            logging.info(f"{css_sel} matches one of the possible combinations")
+            return SELECTOR_MATCHES
+
+        logging.info(f"{css_sel} matches no combination of one extractor")
+        if combination_index.can_contain_combination(matched_bits):
+            return SELECTOR_TOO_BROAD
+        return SELECTOR_FAILS
+
+    match_roots = [m.get_root() for s in samples for m in s.get_matches()]
+    for css_sel in search_path_selectors(match_roots, evaluate, max_candidates, budget):
+        matched_bits = combination_index.select_bits(roots, css_sel)
+        extractor = combination_index.get_extractor(matched_bits)
+        yield Matcher(CssRuleSelector(css_sel), extractor)
+
+
+@_in_search_scope
+def filter_matchers_for_samples(
+    matchers: typing.List[Matcher],
+    samples: typing.List[Sample],
+    new_samples: typing.List[Sample],
+    roots: typing.Optional[typing.List[Node]] = None,
+) -> typing.List[Matcher]:
+    """
+    Keep the matchers that still match the samples after new_samples were added.
+
+    Matchers must match the samples without new_samples, e.g. be generated for them.
+    Nodes below different roots never form one match, so only the roots of the new
+    samples are checked, each with all samples of the root.
+    :param roots: root nodes per sample, the pages if None
+    """
+    if roots is None:
+        roots = [s.page for s in samples]
+
+    new_sample_ids = {id(s) for s in new_samples}
+    new_roots = {id(r): r for s, r in zip(samples, roots) if id(s) in new_sample_ids}
+    for root in new_roots.values():
+        root_samples = [s for s, r in zip(samples, roots) if r is root]
+        combination_index = _MatchCombinationIndex(
+            [s.get_matches() for s in root_samples]
+        )
+        matchers = [
+            matcher
+            for matcher in matchers
+            if combination_index.is_combination(
+                combination_index.select_bits([root], matcher.selector.css_rule),
+                matcher.extractor,
+            )
+        ]
+    return matchers
+
+
+@_in_search_scope
+def filter_selectors_for_nodes(
+    selectors: typing.List[CssRuleSelector],
+    roots: typing.List[Node],
+    nodes_per_root: typing.List[typing.List[Node]],
+) -> typing.List[CssRuleSelector]:
+    """
+    Keep the selectors that select exactly the given nodes below each root.
+    """
+    bits_per_root = [
+        (root, get_node_bits([n.node_id for n in nodes]))
+        for root, nodes in zip(roots, nodes_per_root)
+    ]
+    return [
+        selector
+        for selector in selectors
+        if all(
+            select_node_bits(root, selector.css_rule) == bits
+            for root, bits in bits_per_root
+        )
     ]
 
-    for sample in samples:
-        for match in sample.get_matches():
-            for css_sel in match.get_root().generate_path_selectors():
-                logging.info(f"testing selector: {css_sel}")
-                matched_nodes = set(flatten(root.select(css_sel) for root in roots))
-                if matched_nodes in node_combinations:
-                    logging.info(f"{css_sel} matches one of the possible combinations")
-                    i = node_combinations.index(matched_nodes)
-                    matches = match_combinations[i]
-                    match_extractors = {m.extractor for m in matches}
-                    if len(match_extractors) == 1:
-                        logging.info(f"{css_sel} matches same extractors")
-                        selector = CssRuleSelector(css_sel)
-                        extractor = next(iter(match_extractors))
-                        yield Matcher(selector, extractor)
-                    else:
-                        logging.info(
-                            f"{css_sel} would need different extractors, ignoring: {match_extractors}"
-                        )
+
+class _MatchCombinationIndex:
+    """
+    Decides whether a node set is the set of roots of a combination of matches,
+    i.e. one match per sample, that all use the same extractor.
+
+    Node sets are bitsets over the nodes of all pages, each page has its own
+    range of bits starting at its offset. Whole sets are checked with bitwise
+    operations first, only sets passing them are looked at node by node.
+    """
+
+    def __init__(self, matches_per_sample: typing.List[typing.List[Match]]):
+        self.sample_count = len(matches_per_sample)
+        self._offset_per_page = {}
+        self._bit_count = 0
+
+        # extractor -> bit of node -> indices of samples matched at the node
+        self.samples_per_bit_per_extractor = {}
+        # extractor -> bits of the nodes matched by each sample
+        self.bits_per_sample_per_extractor = {}
+        for i, matches in enumerate(matches_per_sample):
+            for match in matches:
+                bit = self._get_bit(match.get_root())
+                samples_per_bit = self.samples_per_bit_per_extractor.setdefault(
+                    match.extractor, {}
+                )
+                samples_per_bit.setdefault(bit, set()).add(i)
+                bits_per_sample = self.bits_per_sample_per_extractor.setdefault(
+                    match.extractor, [0] * self.sample_count
+                )
+                bits_per_sample[i] |= 1 << bit
+
+        # extractor -> bits of all nodes matched by any sample
+        self.bits_per_extractor = {}
+        for extractor, bits_per_sample in self.bits_per_sample_per_extractor.items():
+            self.bits_per_extractor[extractor] = 0
+            for bits in bits_per_sample:
+                self.bits_per_extractor[extractor] |= bits
+
+        self._extractor_per_bits = {}
+
+    def _get_offset(self, page) -> int:
+        if page not in self._offset_per_page:
+            self._offset_per_page[page] = self._bit_count
+            self._bit_count += page.get_node_count()
+        return self._offset_per_page[page]
+
+    def _get_bit(self, node: Node) -> int:
+        return self._get_offset(node.page) + node.node_id
+
+    def select_bits(self, roots: typing.List[Node], css_selector: str) -> int:
+        """
+        Select nodes below all roots as one bitset of this index.
+        """
+        bits = 0
+        for root in roots:
+            bits |= select_node_bits(root, css_selector) << self._get_offset(root.page)
+        return bits
+
+    def get_extractor(self, bits: int):
+        """
+        Get the extractor of a combination with the given roots or None.
+        """
+        if bits not in self._extractor_per_bits:
+            self._extractor_per_bits[bits] = next(
+                (
+                    extractor
+                    for extractor in self.samples_per_bit_per_extractor
+                    if self.is_combination(bits, extractor)
+                ),
+                None,
+            )
+        return self._extractor_per_bits[bits]
+
+    def is_combination(self, bits: int, extractor) -> bool:
+        """
+        Check if the nodes are the roots of a combination using the extractor.
+        """
+        if not bits or extractor not in self.bits_per_extractor:
+            return False
+
+        # every node needs to match a sample and every sample needs a match
+        if bits & ~self.bits_per_extractor[extractor]:
+            return False
+        if not all(bits & b for b in self.bits_per_sample_per_extractor[extractor]):
+            return False
+        if count_nodes(bits) > self.sample_count:
+            return False
+
+        # every node needs a sample of its own, samples left over can share nodes
+        samples_per_bit = self.samples_per_bit_per_extractor[extractor]
+        return _has_complete_matching(
+            [samples_per_bit[bit] for bit in generate_node_ids(bits)],
+            self.sample_count,
+        )
+
+    def can_contain_combination(self, bits: int) -> bool:
+        """
+        Check if a subset of the nodes could be a combination, i.e. if all samples
+        have a match among the nodes for one of the extractors.
+        """
+        return any(
+            all(bits & b for b in bits_per_sample)
+            for bits_per_sample in self.bits_per_sample_per_extractor.values()
+        )
+
+
+def _has_complete_matching(samples_per_node: typing.List[set], sample_count) -> bool:
+    """
+    Check if each node can be assigned a different sample (bipartite matching).
+    """
+    node_per_sample = [None] * sample_count
+
+    def assign(node_index, samples_visited):
+        for sample in samples_per_node[node_index]:
+            if sample in samples_visited:
+                continue
+            samples_visited.add(sample)
+            if node_per_sample[sample] is None or assign(
+                node_per_sample[sample], samples_visited
+            ):
+                node_per_sample[sample] = node_index
+                return True
+        return False
+
+    return all(assign(i, set()) for i in range(len(samples_per_node)))
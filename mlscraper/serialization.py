@@ -0,0 +1,155 @@
+"""
+Versioned serialization of trained scraper trees.
+
+Scrapers are stored as compact JSON of nested lists:
+["dict", {key: scraper}], ["list", css rule, scraper] and
+["value", css rule, extractor] with "text" or ["attr", name] as extractor.
+Loading only needs the scraping modules, not the training ones.
+"""
+
+import json
+import typing
+
+import soupsieve
+
+from mlscraper.css import parse_path_selector
+from mlscraper.scrapers import DictScraper, ListScraper, Scraper, ValueScraper
+from mlscraper.util import (
+    AttributeValueExtractor,
+    CssRuleSelector,
+    Extractor,
+    TextValueExtractor,
+    get_attribute_extractor,
+    get_text_extractor,
+)
+from mlscraper.xpath import XPathTranslationException, compile_css_rule
+
+FORMAT_VERSION = 1
+
+
+class SerializationException(Exception):
+    pass
+
+
+def dumps_scraper(scraper: Scraper) -> str:
+    return json.dumps(
+        {"version": FORMAT_VERSION, "scraper": _dump_scraper(scraper)},
+        separators=(",", ":"),
+        ensure_ascii=False,
+    )
+
+
+def loads_scraper(data: str, backend: str = "soup") -> Scraper:
+    """
+    Load a scraper and precompile its selectors for the given page backend.
+    """
+    try:
+        document = json.loads(data)
+    except json.JSONDecodeError as e:
+        raise SerializationException(f"invalid scraper data: {e}") from e
+
+    if not isinstance(document, dict) or "scraper" not in document:
+        raise SerializationException("no scraper in data")
+    if document.get("version") != FORMAT_VERSION:
+        raise SerializationException(
+            f"unsupported format version: {document.get('version')}"
+        )
+
+    return _load_scraper(document["scraper"], backend)
+
+
+def save_scraper(scraper: Scraper, path):
+    with open(path, "w", encoding="utf-8") as file:
+        file.write(dumps_scraper(scraper))
+
+
+def load_scraper(path, backend: str = "soup") -> Scraper:
+    with open(path, encoding="utf-8") as file:
+        return loads_scraper(file.read(), backend)
+
+
+def _dump_scraper(scraper: Scraper) -> list:
+    if isinstance(scraper, DictScraper):
+        return [
+            "dict",
+            {k: _dump_scraper(s) for k, s in scraper.scraper_per_key.items()},
+        ]
+
+    if isinstance(scraper, ListScraper):
+        return [
+            "list",
+            _dump_selector(scraper.selector),
+            _dump_scraper(scraper.scraper),
+        ]
+
+    if isinstance(scraper, ValueScraper):
+        return [
+            "value",
+            _dump_selector(scraper.selector),
+            _dump_extractor(scraper.extractor),
+        ]
+
+    raise SerializationException(f"cannot serialize scraper: {scraper}")
+
+
+def _dump_selector(selector) -> str:
+    if not isinstance(selector, CssRuleSelector):
+        raise SerializationException(f"cannot serialize selector: {selector}")
+    return selector.css_rule
+
+
+def _dump_extractor(extractor: Extractor) -> typing.Union[str, list]:
+    if isinstance(extractor, TextValueExtractor):
+        return "text"
+    if isinstance(extractor, AttributeValueExtractor):
+        return ["attr", extractor.attr]
+    raise SerializationException(f"cannot serialize extractor: {extractor}")
+
+
+def _load_scraper(data, backend: str) -> Scraper:
+    try:
+        kind, *arguments = data
+        if kind == "dict":
+            (scraper_data_per_key,) = arguments
+            return DictScraper(
+                {k: _load_scraper(d, backend) for k, d in scraper_data_per_key.items()}
+            )
+
+        if kind == "list":
+            css_rule, scraper_data = arguments
+            return ListScraper(
+                _load_selector(css_rule, backend), _load_scraper(scraper_data, backend)
+            )
+
+        if kind == "value":
+            css_rule, extractor_data = arguments
+            return ValueScraper(
+                _load_selector(css_rule, backend), _load_extractor(extractor_data)
+            )
+    except (TypeError, ValueError, AttributeError) as e:
+        raise SerializationException(f"invalid scraper: {data}") from e
+
+    raise SerializationException(f"unknown scraper: {data}")
+
+
+def _load_selector(css_rule: str, backend: str) -> CssRuleSelector:
+    if not isinstance(css_rule, str):
+        raise SerializationException(f"invalid css rule: {css_rule}")
+
+    # compile now, so the first page does not pay for it
+    try:
+        if backend == "lxml":
+            compile_css_rule(css_rule)
+        elif parse_path_selector(css_rule) is None:
+            soupsieve.compile(css_rule)
+    except (XPathTranslationException, soupsieve.SelectorSyntaxError) as e:
+        raise SerializationException(f"unsupported css rule: {css_rule}") from e
+    return CssRuleSelector(css_rule)
+
+
+def _load_extractor(data) -> Extractor:
+    if data == "text":
+        return get_text_extractor()
+    if isinstance(data, list) and len(data) == 2 and data[0] == "attr":
+        return get_attribute_extractor(data[1])
+    raise SerializationException(f"unknown extractor: {data}")
@@ -0,0 +1,175 @@
+"""
+Instrumentation of training.
+
+Training code opens spans for the work it does, e.g. one per item node,
+and counts events like candidates evaluated or cache hits. Counts are
+attributed to the innermost open span. By default the null tracer drops
+everything; ChromeTracer records spans and writes them in the Chrome trace
+event format, which chrome://tracing, Perfetto and speedscope show as
+flame graph.
+
+    with tracing.use_tracer(ChromeTracer()) as tracer:
+        train_scraper(training_set.item)
+    tracer.write("training.trace.json")
+
+Forked workers trace into a tracer of their own from fork and send its
+records back, the parent adds them with merge.
+"""
+
+import json
+import os
+import threading
+import time
+import typing
+from contextlib import contextmanager
+
+
+class Tracer:
+    """
+    Tracer that records nothing.
+    """
+
+    enabled = False
+
+    def span(self, name: str, **args):
+        """
+        Context manager for a unit of work, args describe it.
+        """
+        return _null_span
+
+    def count(self, name: str, value: int = 1):
+        pass
+
+    def fork(self) -> "Tracer":
+        """
+        Tracer to use in a forked worker, with the same time origin.
+        """
+        return self
+
+    def get_records(self) -> typing.Tuple[list, dict]:
+        """
+        Events and counts recorded so far, to pass them to another process.
+        """
+        return [], {}
+
+    def merge(self, records: typing.Tuple[list, dict]):
+        """
+        Add the records of a worker's tracer, see fork.
+        """
+        pass
+
+
+class _NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_null_span = _NullSpan()
+
+
+class ChromeTracer(Tracer):
+    """
+    Records spans as complete events with the counts that happened inside them.
+    """
+
+    enabled = True
+
+    def __init__(self):
+        self.events = []
+        self.counts = {}
+        self._start = time.perf_counter()
+        self._local = threading.local()
+
+    @contextmanager
+    def span(self, name: str, **args):
+        stack = self._get_stack()
+        counts = {}
+        stack.append(counts)
+        start = time.perf_counter()
+        try:
+            yield self
+        finally:
+            end = time.perf_counter()
+            stack.pop()
+            self.events.append(
+                {
+                    "name": name,
+                    "ph": "X",
+                    "ts": self._get_microseconds(start),
+                    "dur": (end - start) * 1e6,
+                    "pid": os.getpid(),
+                    "tid": threading.get_ident(),
+                    "args": {**args, **counts},
+                }
+            )
+
+    def count(self, name: str, value: int = 1):
+        self.counts[name] = self.counts.get(name, 0) + value
+        stack = self._get_stack()
+        if stack:
+            stack[-1][name] = stack[-1].get(name, 0) + value
+
+    def fork(self) -> "ChromeTracer":
+        tracer = ChromeTracer()
+        # perf_counter is the same clock in all processes of the machine
+        tracer._start = self._start
+        return tracer
+
+    def get_records(self) -> typing.Tuple[list, dict]:
+        return self.events, self.counts
+
+    def merge(self, records: typing.Tuple[list, dict]):
+        events, counts = records
+        self.events.extend(events)
+        # totals only, the spans of the worker hold its counts
+        for name, value in counts.items():
+            self.counts[name] = self.counts.get(name, 0) + value
+
+    def get_trace(self) -> dict:
+        return {"traceEvents": self.events, "displayTimeUnit": "ms"}
+
+    def write(self, path):
+        with open(path, "w") as file:
+            json.dump(self.get_trace(), file, default=str)
+
+    def _get_stack(self) -> typing.List[dict]:
+        if not hasattr(self._local, "stack"):
+            self._local.stack = []
+        return self._local.stack
+
+    def _get_microseconds(self, timestamp: float) -> float:
+        return (timestamp - self._start) * 1e6
+
+    def __repr__(self):
+        return f"<{self.__class__.__name__} {len(self.events)=} {self.counts=}>"
+
+
+_tracer = Tracer()
+
+
+def get_tracer() -> Tracer:
+    return _tracer
+
+
+def set_tracer(tracer: typing.Optional[Tracer]):
+    """
+    Set the tracer used from now on, None to stop tracing.
+    """
+    global _tracer
+    _tracer = tracer or Tracer()
+
+
+@contextmanager
+def use_tracer(tracer: Tracer):
+    """
+    Trace with the given tracer inside the block.
+    """
+    previous_tracer = get_tracer()
+    set_tracer(tracer)
+    try:
+        yield tracer
+    finally:
+        set_tracer(previous_tracer)
@@ -1,12 +1,37 @@
 import logging
+import multiprocessing
+import os
 import typing
-from itertools import product
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice, product
 
-from mlscraper.samples import DictItem, Item, ListItem, Sample, ValueItem
-from mlscraper.scrapers import DictScraper, ListScraper, ValueScraper
-from mlscraper.selectors import generate_selector_for_nodes, make_matcher_for_samples
+from mlscraper import selectors, util
+from mlscraper.cache import ScraperCache, get_training_fingerprint
+from mlscraper.samples import (
+    DictItem,
+    Item,
+    ListItem,
+    Sample,
+    TrainingSet,
+    ValueItem,
+)
+from mlscraper.scrapers import DictScraper, ListScraper, Scraper, ValueScraper
+from mlscraper.selectors import (
+    SearchBudget,
+    SearchBudgetExhaustedException,
+    filter_matchers_for_samples,
+    filter_selectors_for_nodes,
+    generate_matchers_for_samples,
+    generate_selector_for_nodes,
+    make_matcher_for_samples,
+    search_scope,
+)
+from mlscraper.tracing import get_tracer, use_tracer
 from mlscraper.util import Node
 
+# candidate matchers kept per value item by the incremental trainer
+CANDIDATES_KEPT_MAX = 50
+
 
 class TrainingException(Exception):
     pass
@@ -16,10 +41,51 @@ class NoScraperFoundException(TrainingException):
     pass
 
 
-def train_scraper(item: Item, roots: typing.Optional[typing.List[Node]] = None):
+def train_scraper(
+    item: Item,
+    roots: typing.Optional[typing.List[Node]] = None,
+    n_jobs: int = 1,
+    cache: typing.Optional[ScraperCache] = None,
+    budget: typing.Optional[SearchBudget] = None,
+):
     """
     Train a scraper able to extract the given training data.
+
+    The search is best-first, the first scraper found is the one returned
+    without a budget. If the budget runs out before, training stops with
+    SearchBudgetExhaustedException telling how far it got.
+    :param item: item to train a scraper for
+    :param roots: root nodes per sample, the pages if None
+    :param n_jobs: processes to train the keys of dicts in, -1 for all cores
+    :param cache: cache of scrapers trained before, used if roots is None
+    :param budget: time and candidates the whole training may use
     """
+    if cache is not None and roots is None:
+        fingerprint = get_training_fingerprint(item, _get_search_parameters())
+        scraper = cache.get(fingerprint)
+        if scraper is not None:
+            logging.info(f"scraper for {item} found in cache")
+            return scraper
+
+        scraper = train_scraper(item, n_jobs=n_jobs, budget=budget)
+        cache.put(fingerprint, scraper)
+        return scraper
+
+    with search_scope(), get_tracer().span(
+        f"train {item.__class__.__name__}", samples=len(item.samples)
+    ):
+        scraper = _train_item(item, roots, n_jobs, budget)
+    if budget is not None:
+        budget.items_trained += 1
+    return scraper
+
+
+def _train_item(
+    item: Item,
+    roots: typing.Optional[typing.List[Node]],
+    n_jobs: int,
+    budget: typing.Optional[SearchBudget],
+):
     logging.info(f"training {item}")
 
     # set roots to page if not set
@@ -31,35 +97,354 @@ def train_scraper(item: Item, roots: typing.Optional[typing.List[Node]] = None):
 
     if isinstance(item, ListItem):
         # todo add root to get_matches
-        matches_per_sample = [s.get_matches() for s in item.item.samples]
+        tracer = get_tracer()
+        # combinations of all entries are generated one at a time
+        matches_per_sample = [s.generate_matches() for s in item.item.samples]
+        entry_roots = _get_entry_roots(item.samples, roots)
         for match_combi in product(*matches_per_sample):
-            print(f"{match_combi=}")
+            if budget is not None:
+                budget.check()
+            tracer.count("match combinations explored")
             match_roots = [m.get_root() for m in match_combi]
-            print(f"{match_roots=}")
-            for selector in generate_selector_for_nodes(match_roots, roots):
+            # a list element only holds one of the list entries
+            if len(set(match_roots)) != len(match_roots):
+                continue
+
+            for selector in generate_selector_for_nodes(
+                match_roots, entry_roots, budget=budget
+            ):
                 # roots are the newly matched root elements
-                item_scraper = train_scraper(item.item, match_roots)
-                scraper = ListScraper(selector, item_scraper)
-                return scraper
+                try:
+                    item_scraper = train_scraper(
+                        item.item, match_roots, n_jobs, budget=budget
+                    )
+                except NoScraperFoundException:
+                    logging.info(f"no item scraper for {match_combi}")
+                    break
+                except SearchBudgetExhaustedException as e:
+                    e.item_path.insert(0, "[]")
+                    raise
+                return ListScraper(selector, item_scraper)
 
         raise NoScraperFoundException(f"no matcher found for {item}")
 
     if isinstance(item, DictItem):
         # train a scraper for each key, keep roots
-        scraper_per_key = {
-            k: train_scraper(i, roots) for k, i in item.item_per_key.items()
-        }
+        if n_jobs != 1 and len(item.item_per_key) > 1:
+            return DictScraper(_train_keys_in_parallel(item, roots, n_jobs, budget))
+
+        tracer = get_tracer()
+        scraper_per_key = {}
+        for k, i in item.item_per_key.items():
+            with tracer.span(f"key {k}"):
+                try:
+                    scraper_per_key[k] = train_scraper(i, roots, budget=budget)
+                except SearchBudgetExhaustedException as e:
+                    e.item_path.insert(0, k)
+                    raise
         return DictScraper(scraper_per_key)
 
     if isinstance(item, ValueItem):
         # find a selector that uniquely matches the value given the root node
-        matcher = make_matcher_for_samples(item.samples, roots)
+        matcher = make_matcher_for_samples(item.samples, roots, budget)
         if matcher:
             return ValueScraper(matcher.selector, matcher.extractor)
         else:
             raise NoScraperFoundException(f"deriving matcher failed for {item}")
 
 
+def _get_search_parameters() -> dict:
+    # everything besides the samples that changes the trained scraper
+    return {
+        "candidates_evaluated_max": selectors.CANDIDATES_EVALUATED_MAX,
+        "parent_node_count_max": util.PARENT_NODE_COUNT_MAX,
+        "css_class_combinations_max": util.CSS_CLASS_COMBINATIONS_MAX,
+    }
+
+
+# dict item, roots and budget used by forked workers, inherited instead of pickled
+_item_and_roots_to_fork = None
+
+
+def _train_keys_in_parallel(
+    item: DictItem,
+    roots: typing.List[Node],
+    n_jobs: int,
+    budget: typing.Optional[SearchBudget] = None,
+):
+    """
+    Train the keys of a dict item in a process pool.
+
+    Workers are forked, so they share the parsed pages of the parent process.
+    Each key is trained exactly as in serial training, results keep key order.
+    What the workers traced is merged into the tracer of the parent.
+    """
+    global _item_and_roots_to_fork
+
+    if "fork" not in multiprocessing.get_all_start_methods():
+        logging.warning("fork is not available, training keys serially")
+        return {
+            k: train_scraper(i, roots, budget=budget)
+            for k, i in item.item_per_key.items()
+        }
+
+    if n_jobs < 0:
+        n_jobs = os.cpu_count()
+    max_workers = min(n_jobs, len(item.item_per_key))
+
+    context = multiprocessing.get_context("fork")
+    if budget is not None:
+        # max_candidates holds for all workers together
+        budget.share_candidates(context)
+    _item_and_roots_to_fork = (item, roots, budget)
+    try:
+        with ProcessPoolExecutor(max_workers, mp_context=context) as executor:
+            keys = list(item.item_per_key.keys())
+            scraper_per_key = {}
+            for key, (scraper, records) in zip(keys, executor.map(_train_key, keys)):
+                scraper_per_key[key] = scraper
+                get_tracer().merge(records)
+            return scraper_per_key
+    finally:
+        _item_and_roots_to_fork = None
+        if budget is not None:
+            budget.unshare_candidates()
+
+
+def _train_key(key):
+    item, roots, budget = _item_and_roots_to_fork
+    # the tracer inherited from the parent would keep the records in this process
+    with use_tracer(get_tracer().fork()) as tracer:
+        with tracer.span(f"key {key}"):
+            try:
+                scraper = train_scraper(item.item_per_key[key], roots, budget=budget)
+            except SearchBudgetExhaustedException as e:
+                e.item_path.insert(0, key)
+                raise
+        return scraper, tracer.get_records()
+
+
+class IncrementalTrainer:
+    """
+    Trains a scraper and keeps it up to date while samples are added.
+
+    Per value item, the matchers found by the search that still match all samples
+    are kept, per list item the list selectors and the node of its entries.
+    A new sample only re-checks them below its own root, an item is searched
+    again once none of them is left.
+    """
+
+    training_set = None
+    _root = None
+
+    def __init__(self, training_set: typing.Optional[TrainingSet] = None):
+        self.training_set = training_set or TrainingSet()
+        if self.training_set.item is not None:
+            with search_scope():
+                self._root = _make_incremental_node(
+                    self.training_set.item,
+                    [s.page for s in self.training_set.item.samples],
+                )
+
+    def add_sample(self, sample: Sample) -> Scraper:
+        """
+        Add a sample to the training set and return the updated scraper.
+        """
+        self.training_set.add_sample(sample)
+        with search_scope():
+            if self._root is None:
+                self._root = _make_incremental_node(
+                    self.training_set.item,
+                    [s.page for s in self.training_set.item.samples],
+                )
+            else:
+                self._root.update([sample.page])
+        return self.get_scraper()
+
+    def get_scraper(self) -> Scraper:
+        if self._root is None:
+            raise TrainingException("no samples to train on")
+        return self._root.get_scraper()
+
+    def __repr__(self):
+        return f"<{self.__class__.__name__} {self.training_set=}>"
+
+
+def _make_incremental_node(item: Item, roots: typing.List[Node]):
+    if isinstance(item, DictItem):
+        return _IncrementalDictNode(item, roots)
+    if isinstance(item, ListItem):
+        return _IncrementalListNode(item, roots)
+    return _IncrementalValueNode(item, roots)
+
+
+class _IncrementalValueNode:
+    def __init__(self, item: ValueItem, roots: typing.List[Node]):
+        self.item = item
+        self.roots = list(roots)
+        self.matchers = self._search()
+
+    def _search(self):
+        logging.info(f"searching matchers for {self.item}")
+        matchers = list(
+            islice(
+                generate_matchers_for_samples(self.item.samples, self.roots),
+                CANDIDATES_KEPT_MAX,
+            )
+        )
+        if not matchers:
+            raise NoScraperFoundException(f"deriving matcher failed for {self.item}")
+        return matchers
+
+    def update(self, new_roots: typing.List[Node]):
+        """
+        Account for the samples added since, new_roots are their root nodes.
+        """
+        sample_count = len(self.roots)
+        new_samples = self.item.samples[sample_count:]
+        if not new_samples:
+            return
+        self.roots += new_roots
+
+        self.matchers = filter_matchers_for_samples(
+            self.matchers, self.item.samples, new_samples, self.roots
+        )
+        if not self.matchers:
+            logging.info(f"no matcher left for {self.item}")
+            self.matchers = self._search()
+
+    def get_scraper(self) -> Scraper:
+        # matchers keep the order of the search, the first one is the best
+        matcher = self.matchers[0]
+        return ValueScraper(matcher.selector, matcher.extractor)
+
+
+class _IncrementalDictNode:
+    def __init__(self, item: DictItem, roots: typing.List[Node]):
+        self.item = item
+        self.roots = list(roots)
+        self.node_per_key = {
+            k: _make_incremental_node(i, _get_roots_of_key(item.samples, self.roots, k))
+            for k, i in item.item_per_key.items()
+        }
+
+    def update(self, new_roots: typing.List[Node]):
+        sample_count = len(self.roots)
+        new_samples = self.item.samples[sample_count:]
+        self.roots += new_roots
+        for key, item in self.item.item_per_key.items():
+            if key in self.node_per_key:
+                key_roots = _get_roots_of_key(new_samples, new_roots, key)
+                if key_roots:
+                    self.node_per_key[key].update(key_roots)
+            else:
+                # key seen for the first time
+                key_roots = _get_roots_of_key(self.item.samples, self.roots, key)
+                self.node_per_key[key] = _make_incremental_node(item, key_roots)
+
+    def get_scraper(self) -> Scraper:
+        return DictScraper({k: n.get_scraper() for k, n in self.node_per_key.items()})
+
+
+def _get_roots_of_key(samples: typing.List[Sample], roots: typing.List[Node], key):
+    # keys can be missing in some samples
+    return [r for s, r in zip(samples, roots) if key in s.value]
+
+
+class _IncrementalListNode:
+    """
+    Keeps the list selectors found for one combination of entry matches and
+    the node of the entries, trained with their matches as roots.
+    """
+
+    def __init__(self, item: ListItem, roots: typing.List[Node]):
+        self.item = item
+        self.roots = list(roots)
+        self.selectors, self.entry_node = self._search()
+
+    def _search(self):
+        logging.info(f"searching list selectors for {self.item}")
+        if self.item.item is None:
+            raise NoScraperFoundException(f"no entries to train on for {self.item}")
+
+        entry_roots = _get_entry_roots(self.item.samples, self.roots)
+        matches_per_entry = [s.generate_matches() for s in self.item.item.samples]
+        for match_combi in product(*matches_per_entry):
+            match_roots = [m.get_root() for m in match_combi]
+            # a list element only holds one of the list entries
+            if len(set(match_roots)) != len(match_roots):
+                continue
+
+            selectors = list(
+                islice(
+                    generate_selector_for_nodes(match_roots, entry_roots),
+                    CANDIDATES_KEPT_MAX,
+                )
+            )
+            if not selectors:
+                continue
+            try:
+                entry_node = _make_incremental_node(self.item.item, match_roots)
+            except NoScraperFoundException:
+                logging.info(f"no item scraper for {match_combi}")
+                continue
+            return selectors, entry_node
+
+        raise NoScraperFoundException(f"no matcher found for {self.item}")
+
+    def update(self, new_roots: typing.List[Node]):
+        sample_count = len(self.roots)
+        new_samples = self.item.samples[sample_count:]
+        if not new_samples:
+            return
+        self.roots += new_roots
+
+        if not self._update_candidates(new_samples, new_roots):
+            logging.info(f"no list selector left for {self.item}")
+            self.selectors, self.entry_node = self._search()
+
+    def _update_candidates(
+        self, new_samples: typing.List[Sample], new_roots: typing.List[Node]
+    ) -> bool:
+        # entries of the new lists are the last ones of the entry item
+        entry_samples = self.item.item.samples
+        entry_count = sum(len(s.value) for s in new_samples)
+        first_new_entry = len(entry_samples) - entry_count
+        new_entry_samples = entry_samples[first_new_entry:]
+        new_entry_roots = _get_entry_roots(new_samples, new_roots)
+
+        matches_per_entry = [s.generate_matches() for s in new_entry_samples]
+        for match_combi in product(*matches_per_entry):
+            match_roots = [m.get_root() for m in match_combi]
+            if len(set(match_roots)) != len(match_roots):
+                continue
+
+            nodes_per_root = [
+                [n for n, r in zip(match_roots, new_entry_roots) if r is root]
+                for root in new_roots
+            ]
+            selectors = filter_selectors_for_nodes(
+                self.selectors, new_roots, nodes_per_root
+            )
+            if not selectors:
+                continue
+            try:
+                self.entry_node.update(match_roots)
+            except NoScraperFoundException:
+                return False
+            self.selectors = selectors
+            return True
+        return False
+
+    def get_scraper(self) -> Scraper:
+        return ListScraper(self.selectors[0], self.entry_node.get_scraper())
+
+
+def _get_entry_roots(samples: typing.List[Sample], roots: typing.List[Node]):
+    # the root of each entry is the root of the list it belongs to
+    return [r for r, s in zip(roots, samples) for _ in s.value]
+
+
 def get_smallest_span_match_per_sample(samples: typing.List[Sample]):
     """
     Get the best match for each sample by using the smallest span.
@@ -67,6 +452,6 @@ def get_smallest_span_match_per_sample(samples: typing.List[Sample]):
     :return:
     """
     best_match_per_sample = [
-        sorted(s.get_matches(), key=lambda m: m.get_span())[0] for s in samples
+        min(s.generate_matches(), key=lambda m: m.get_span()) for s in samples
     ]
     return best_match_per_sample
@@ -1,15 +1,87 @@
 import logging
 import typing
+import weakref
+from array import array
+from collections import OrderedDict, namedtuple
 from itertools import combinations, product
 
-from bs4 import BeautifulSoup, Tag
+from bs4 import BeautifulSoup, NavigableString, Tag
 from more_itertools import powerset
 
+from mlscraper.css import PathSelectorIndex, parse_path_selector
+from mlscraper.tracing import get_tracer
+from mlscraper.xpath import LxmlPage
+
 PARENT_NODE_COUNT_MAX = 2
 CSS_CLASS_COMBINATIONS_MAX = 2
 
 extractor_instance_map = {}
-node_instance_map = {}
+
+
+CacheInfo = namedtuple("CacheInfo", ["hits", "misses", "maxsize", "currsize"])
+
+
+class LRUCache:
+    """
+    Bounded mapping that evicts the least recently used entries.
+    """
+
+    maxsize = None
+    name = None
+    hits = None
+    misses = None
+
+    def __init__(self, maxsize: int = 1024, name: typing.Optional[str] = None):
+        self.maxsize = maxsize
+        self.name = name
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+
+        # hits and misses of named caches are traced
+        self._hit_event = f"{name} hits" if name else None
+        self._miss_event = f"{name} misses" if name else None
+
+    def get_or_compute(self, key, compute: typing.Callable):
+        """
+        Return the cached value for key or compute, store and return it.
+        """
+        try:
+            value = self._entries[key]
+        except KeyError:
+            self.misses += 1
+            if self._miss_event:
+                get_tracer().count(self._miss_event)
+        else:
+            self.hits += 1
+            if self._hit_event:
+                get_tracer().count(self._hit_event)
+            self._entries.move_to_end(key)
+            return value
+
+        value = compute()
+        self._entries[key] = value
+        if len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+        return value
+
+    def get_info(self) -> CacheInfo:
+        return CacheInfo(self.hits, self.misses, self.maxsize, len(self._entries))
+
+    def get_hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def clear(self):
+        self._entries.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __repr__(self):
+        return f"<{self.__class__.__name__} {self.get_info()}>"
 
 
 def get_text_extractor():
@@ -26,30 +98,50 @@ def get_attribute_extractor(attr):
     return extractor_instance_map[map_key]
 
 
-def get_node_for_soup(soup):
-    # use id to avoid __hash__
-    soup_key = id(soup)
+class Node:
+    # training creates nodes and matches by the million, slots keep them small
+    __slots__ = ("soup", "node_id", "_page", "__weakref__")
 
-    if soup_key not in node_instance_map:
-        node_instance_map[soup_key] = Node(soup)
-    return node_instance_map[soup_key]
+    def __init__(self, soup, page=None, node_id=None):
+        self.soup = soup
+        self.node_id = node_id
+        self._page = page
 
+    def get_page(self):
+        return self._page
 
-class Node:
-    soup = None
+    page = property(get_page)
 
-    def __init__(self, soup):
-        self.soup = soup
+    def get_node(self, soup):
+        """
+        Get the node for another soup element of the same page.
+        """
+        if self.page is None:
+            return Node(soup)
+        return self.page.get_node(soup)
 
     def get_root(self):
+        if self.page is not None:
+            return self.page
         root_soup = list(self.soup.parents)[-1]
-        return get_node_for_soup(root_soup)
+        return self.get_node(root_soup)
+
+    def is_ancestor_of(self, node) -> bool:
+        """
+        Check if the given node is a descendant of this node.
+        """
+        if self.page is not None and self.page is node.page:
+            return self.page.is_ancestor(self.node_id, node.node_id)
+        return any(parent is self.soup for parent in node.soup.parents)
 
     def get_text(self):
         return self.soup.text
 
     text = property(get_text)
 
+    def get_attribute(self, attr: str):
+        return self.soup.attrs.get(attr)
+
     def find_all(self, item):
         return list(self._generate_find_all(item))
 
@@ -58,18 +150,44 @@ class Node:
 
         # text
         for soup_node in self.soup.find_all(text=item):
-            node = get_node_for_soup(soup_node.parent)
+            node = self.get_node(soup_node.parent)
             yield ValueMatch(node, get_text_extractor())
 
         # attributes
         for soup_node in self.soup.find_all():
             for attr in soup_node.attrs:
                 if soup_node[attr] == item:
-                    node = get_node_for_soup(soup_node)
+                    node = self.get_node(soup_node)
                     yield ValueMatch(node, get_attribute_extractor(attr))
 
         # todo implement other find methods
 
+    def get_selectable_path(self):
+        """
+        The node and its ancestors usable in path selectors, from bottom to top.
+
+        Each soup element is paired with its sibling positions if the page knows them.
+        """
+        # remove unique parents as they don't improve selection
+        # body is unique, html is unique, document is bs4 root element
+        if self.page is not None:
+            page = self.page
+            path = [(self.soup, page.get_sibling_positions(self.node_id))]
+            parent_id = page.get_parent_id(self.node_id)
+            while parent_id > 0:
+                if page._soups[parent_id].name not in ("body", "html"):
+                    path.append(
+                        (page._soups[parent_id], page.get_sibling_positions(parent_id))
+                    )
+                parent_id = page.get_parent_id(parent_id)
+            return path
+
+        return [(self.soup, None)] + [
+            (n, None)
+            for n in self.soup.parents
+            if n.name not in ("body", "html", "[document]")
+        ]
+
     def generate_path_selectors(self):
         """
         Generate a selector for the path to the given node.
@@ -87,12 +205,7 @@ class Node:
         # 2) append possible selectors for the n-1 descendants
         # starting with all node selectors and increasing number of used descendants
 
-        # remove unique parents as they don't improve selection
-        # body is unique, html is unique, document is bs4 root element
-        parents = [
-            n for n in self.soup.parents if n.name not in ("body", "html", "[document]")
-        ]
-        # print(parents)
+        path_start, *parents = self.get_selectable_path()
 
         # loop from i=0 to i=len(parents) as we consider all parents
         parent_node_count_max = min(len(parents), PARENT_NODE_COUNT_MAX)
@@ -102,13 +215,14 @@ class Node:
             )
             # generate paths with exactly parent_node_count nodes
             for parent_nodes_sampled in combinations(parents, parent_node_count):
-                path_sampled = (self.soup,) + parent_nodes_sampled
+                path_sampled = (path_start,) + parent_nodes_sampled
                 # logging.info(path_sampled)
 
                 # make a list of selector generators for each node in the path
                 # todo limit generated selectors -> huge product
                 selector_generators_for_each_path_node = [
-                    generate_node_selector(n) for n in path_sampled
+                    generate_node_selector(n, positions)
+                    for n, positions in path_sampled
                 ]
 
                 # generator that outputs selector paths
@@ -126,7 +240,30 @@ class Node:
                     yield css_selector
 
     def select(self, css_selector):
-        return [get_node_for_soup(n) for n in self.soup.select(css_selector)]
+        if self.page is not None:
+            # generated path selectors are evaluated on the page index
+            compounds = parse_path_selector(css_selector)
+            if compounds is not None:
+                page = self.page
+                node_ids = page.get_path_selector_index().select_ids(
+                    self.node_id, compounds
+                )
+                return [page.get_node_by_id(node_id) for node_id in node_ids]
+
+        return [self.get_node(n) for n in self.soup.select(css_selector)]
+
+    def select_bits(self, css_selector) -> int:
+        """
+        Select nodes as bitset of their ids, bit i is set if node i of the page is.
+        """
+        if self.page is None:
+            raise RuntimeError("only nodes of a page have ids")
+
+        compounds = parse_path_selector(css_selector)
+        if compounds is not None:
+            index = self.page.get_path_selector_index()
+            return get_node_bits(index.select_ids(self.node_id, compounds))
+        return get_node_bits(n.node_id for n in self.select(css_selector))
 
     def __repr__(self):
         return f"<{self.__class__.__name__}>"
@@ -137,6 +274,8 @@ class Match:
     Occurrence of a specific sample on a page
     """
 
+    __slots__ = ()
+
     def get_span(self) -> int:
         raise NotImplementedError()
 
@@ -145,13 +284,30 @@ class Match:
 
 
 class DictMatch(Match):
-    match_by_key = None
+    # keys are shared by all matches of a sample, match_by_key is built on access
+    __slots__ = ("keys", "matches", "root")
 
     def __init__(self, match_by_key: dict):
-        self.match_by_key = match_by_key
+        self._set_matches(tuple(match_by_key.keys()), tuple(match_by_key.values()))
 
-        soup_nodes = [m.get_root().soup for m in self.match_by_key.values()]
-        self.root = get_node_for_soup(_get_root_of_nodes(soup_nodes))
+    @classmethod
+    def from_combination(cls, keys: tuple, matches: tuple) -> "DictMatch":
+        """
+        Create a match with one match per key, without building a dict.
+        """
+        match = cls.__new__(cls)
+        match._set_matches(keys, matches)
+        return match
+
+    def _set_matches(self, keys: tuple, matches: tuple):
+        self.keys = keys
+        self.matches = matches
+        self.root = get_common_ancestor([m.get_root() for m in matches])
+
+    def get_match_by_key(self) -> dict:
+        return dict(zip(self.keys, self.matches))
+
+    match_by_key = property(get_match_by_key)
 
     def __repr__(self):
         return f"<{self.__class__.__name__} {self.match_by_key=}>"
@@ -161,19 +317,15 @@ class DictMatch(Match):
 
     def get_span(self) -> int:
         root = self.get_root()
-        return sum(
-            [get_relative_depth(m.get_root(), root) for m in self.match_by_key.values()]
-        )
+        return sum([get_relative_depth(m.get_root(), root) for m in self.matches])
 
 
 class ListMatch(Match):
-    matches = None
+    __slots__ = ("matches", "root")
 
     def __init__(self, matches: tuple):
         self.matches = matches
-        self.root = get_node_for_soup(
-            _get_root_of_nodes([m.get_root().soup for m in self.matches])
-        )
+        self.root = get_common_ancestor([m.get_root() for m in self.matches])
 
     def __repr__(self):
         return f"<{self.__class__.__name__} {self.matches=}>"
@@ -188,8 +340,7 @@ class ListMatch(Match):
 
 
 class ValueMatch(Match):
-    node = None
-    extractor = None
+    __slots__ = ("node", "extractor")
 
     def __init__(self, node, extractor):
         self.node = node
@@ -215,6 +366,212 @@ class Page(Node):
         soup = BeautifulSoup(self.html, "lxml")
         super().__init__(soup)
 
+        self._index_structure()
+
+        # one node per element while anyone uses it, freed with the page
+        self._node_by_id = weakref.WeakValueDictionary()
+        self._node_by_id[0] = self
+        self.node_id = 0
+
+        # built on first lookup as only training needs them
+        self._value_index = None
+        self._shallowest_tables = None
+        self._path_selector_index = None
+
+    def _index_structure(self):
+        """
+        Number all elements in document order (pre-order) with the document as 0.
+
+        The descendants of element i are then exactly the elements
+        i+1..subtree_ends[i], which makes ancestor checks interval checks.
+        """
+        self._soups = [self.soup]
+        # soup ids are stable as the page keeps its whole tree alive
+        self._node_id_by_soup_id = {id(self.soup): 0}
+        self._parents = array("i", [-1])
+        self._depths = array("i", [0])
+
+        # 1-based positions among element siblings, for nth-child and nth-of-type
+        self._child_positions = array("i", [0])
+        self._type_positions = array("i", [0])
+        child_counts = array("i", [0])
+        type_counts = {}
+
+        for soup_node in self.soup.descendants:
+            if not isinstance(soup_node, Tag):
+                continue
+
+            node_id = len(self._soups)
+            parent_id = self._node_id_by_soup_id[id(soup_node.parent)]
+            self._soups.append(soup_node)
+            self._node_id_by_soup_id[id(soup_node)] = node_id
+            self._parents.append(parent_id)
+            self._depths.append(self._depths[parent_id] + 1)
+
+            child_counts[parent_id] += 1
+            child_counts.append(0)
+            self._child_positions.append(child_counts[parent_id])
+            type_key = (parent_id, soup_node.name)
+            type_counts[type_key] = type_counts.get(type_key, 0) + 1
+            self._type_positions.append(type_counts[type_key])
+
+        # children come after their parents, so one backward pass suffices
+        self._subtree_ends = array("i", range(len(self._soups)))
+        for node_id in range(len(self._soups) - 1, 0, -1):
+            parent_id = self._parents[node_id]
+            if self._subtree_ends[node_id] > self._subtree_ends[parent_id]:
+                self._subtree_ends[parent_id] = self._subtree_ends[node_id]
+
+    def get_page(self):
+        return self
+
+    page = property(get_page)
+
+    def get_node(self, soup):
+        return self.get_node_by_id(self._node_id_by_soup_id[id(soup)])
+
+    def get_node_by_id(self, node_id: int) -> Node:
+        try:
+            return self._node_by_id[node_id]
+        except KeyError:
+            node = Node(self._soups[node_id], self, node_id)
+            self._node_by_id[node_id] = node
+            return node
+
+    def get_node_count(self) -> int:
+        return len(self._soups)
+
+    def get_parent_id(self, node_id: int) -> int:
+        return self._parents[node_id]
+
+    def get_depth(self, node_id: int) -> int:
+        return self._depths[node_id]
+
+    def get_path_selector_index(self) -> PathSelectorIndex:
+        if self._path_selector_index is None:
+            self._path_selector_index = PathSelectorIndex(self)
+        return self._path_selector_index
+
+    def get_sibling_positions(self, node_id: int) -> typing.Tuple[int, int]:
+        """
+        1-based index among element siblings and among siblings of the same tag.
+        """
+        return self._child_positions[node_id], self._type_positions[node_id]
+
+    def get_subtree_end(self, node_id: int) -> int:
+        """
+        Id of the last descendant of the node, the node itself if it has none.
+        """
+        return self._subtree_ends[node_id]
+
+    def is_ancestor(self, ancestor_id: int, node_id: int) -> bool:
+        return ancestor_id < node_id <= self._subtree_ends[ancestor_id]
+
+    def get_common_ancestor_id(self, node_ids: typing.Iterable[int]) -> int:
+        """
+        Id of the lowest common ancestor (or self) of the given nodes in O(#nodes).
+
+        The common ancestor of a set of nodes is the one of its first and last node
+        in document order. For first < last, it's the parent of the shallowest node
+        in first+1..last, which is a range minimum query on the depths.
+        """
+        node_ids = list(node_ids)
+        first = min(node_ids)
+        last = max(node_ids)
+        if first == last or self.is_ancestor(first, last):
+            return first
+        return self._parents[self._get_shallowest_id(first + 1, last)]
+
+    def _get_shallowest_id(self, start: int, end: int) -> int:
+        """
+        Id of the node with the smallest depth in start..end (inclusive).
+        """
+        if self._shallowest_tables is None:
+            self._shallowest_tables = self._build_shallowest_tables()
+
+        level = (end - start + 1).bit_length() - 1
+        table = self._shallowest_tables[level]
+        node_id_1 = table[start]
+        node_id_2 = table[end - (1 << level) + 1]
+        if self._depths[node_id_1] <= self._depths[node_id_2]:
+            return node_id_1
+        return node_id_2
+
+    def _build_shallowest_tables(self):
+        """
+        Sparse table: level k holds the shallowest node of each range of 2^k nodes.
+        """
+        depths = self._depths
+        tables = [array("i", range(len(depths)))]
+        width = 1
+        while 2 * width <= len(depths):
+            previous = tables[-1]
+            table = array("i")
+            for i in range(len(depths) - 2 * width + 1):
+                node_id_1 = previous[i]
+                node_id_2 = previous[i + width]
+                table.append(
+                    node_id_1 if depths[node_id_1] <= depths[node_id_2] else node_id_2
+                )
+            tables.append(table)
+            width *= 2
+        return tables
+
+    def _generate_find_all(self, item):
+        assert isinstance(item, str)
+
+        text_index, attribute_index = self._get_value_index()
+
+        # same order as the tree search: text matches first, then attributes
+        for node_id in text_index.get(item, ()):
+            yield ValueMatch(self.get_node_by_id(node_id), get_text_extractor())
+
+        for node_id, attr in attribute_index.get(item, ()):
+            node = self.get_node_by_id(node_id)
+            yield ValueMatch(node, get_attribute_extractor(attr))
+
+    def _get_value_index(self):
+        """
+        Index mapping each text and attribute value to the nodes containing it.
+        """
+        if self._value_index is None:
+            text_index = {}
+            attribute_index = {}
+            node_id_by_soup_id = self._node_id_by_soup_id
+            for soup_node in self.soup.descendants:
+                if isinstance(soup_node, NavigableString):
+                    node_id = node_id_by_soup_id[id(soup_node.parent)]
+                    text_index.setdefault(str(soup_node), []).append(node_id)
+                elif isinstance(soup_node, Tag):
+                    node_id = node_id_by_soup_id[id(soup_node)]
+                    for attr, value in soup_node.attrs.items():
+                        # multi-valued attributes like class are lists
+                        if isinstance(value, str):
+                            attribute_index.setdefault(value, []).append(
+                                (node_id, attr)
+                            )
+            self._value_index = (text_index, attribute_index)
+        return self._value_index
+
+
+def parse_page(
+    html, backend: str = "soup", required_rules: typing.Optional[list] = None
+):
+    """
+    Parse a page with the given backend.
+
+    Training needs the "soup" backend and its indexes. Trained scrapers also run
+    on "lxml" pages, which skip the soup and evaluate selectors as XPath.
+    :param required_rules: css rules to parse lxml pages until their first match
+    """
+    if backend == "soup":
+        if required_rules is not None:
+            raise ValueError("partial parsing needs the lxml backend")
+        return Page(html)
+    if backend == "lxml":
+        return LxmlPage(html, required_rules)
+    raise ValueError(f"unknown page backend: {backend}")
+
 
 class Extractor:
     """
@@ -231,7 +588,11 @@ class TextValueExtractor(Extractor):
     """
 
     def extract(self, node: Node):
-        return node.soup.text
+        return node.get_text()
+
+    def __reduce__(self):
+        # keep extractors unique across processes
+        return get_text_extractor, ()
 
     def __repr__(self):
         return f"<{self.__class__.__name__}>"
@@ -244,8 +605,10 @@ class AttributeValueExtractor(Extractor):
         self.attr = attr
 
     def extract(self, node: Node):
-        if self.attr in node.soup.attrs:
-            return node.soup[self.attr]
+        return node.get_attribute(self.attr)
+
+    def __reduce__(self):
+        return get_attribute_extractor, (self.attr,)
 
     def __repr__(self):
         return f"<{self.__class__.__name__} {self.attr=}>"
@@ -263,6 +626,22 @@ class Selector:
         raise NotImplementedError()
 
 
+class CssRuleSelector(Selector):
+    css_rule = None
+
+    def __init__(self, css_rule):
+        self.css_rule = css_rule
+
+    def select_one(self, page: Page):
+        return page.select(self.css_rule)[0]
+
+    def select_all(self, page):
+        return page.select(self.css_rule)
+
+    def __repr__(self):
+        return f"<{self.__class__.__name__} {self.css_rule=}>"
+
+
 class Matcher:
     """
     Class that finds/selects nodes and extracts items from these nodes.
@@ -297,10 +676,11 @@ class DictExtractor(Extractor):
         }
 
 
-def generate_node_selector(node):
+def generate_node_selector(node, positions=None):
     """
     Generate a selector for the given node.
     :param node:
+    :param positions: precomputed (child index, index among same type), 1-based
     :return:
     """
     assert isinstance(node, Tag)
@@ -321,16 +701,25 @@ def generate_node_selector(node):
 
     # todo: nth applies to whole selectors
     #  -> should thus be a step after actual selector generation
-    if isinstance(node.parent, Tag) and hasattr(node, "name"):
+    if positions is not None:
+        child_index, type_index = positions
+        yield ":nth-child(%d)" % child_index
+        yield ":nth-of-type(%d)" % type_index
+    elif isinstance(node.parent, Tag) and hasattr(node, "name"):
+        # compare by identity, equal siblings are different nodes
         children_tags = [c for c in node.parent.children if isinstance(c, Tag)]
-        child_index = list(children_tags).index(node) + 1
+        child_index = _index_by_identity(children_tags, node) + 1
         yield ":nth-child(%d)" % child_index
 
         children_of_same_type = [c for c in children_tags if c.name == node.name]
-        child_index = children_of_same_type.index(node) + 1
+        child_index = _index_by_identity(children_of_same_type, node) + 1
         yield ":nth-of-type(%d)" % child_index
 
 
+def _index_by_identity(items, item):
+    return next(i for i, candidate in enumerate(items) if candidate is item)
+
+
 def powerset_max_length(candidates, length):
     return filter(lambda s: len(s) <= length, powerset(candidates))
 
@@ -364,12 +753,57 @@ def _get_root_of_paths(paths):
 
 
 def get_relative_depth(node: Node, root: Node):
-    node_parents = list(node.soup.parents)
+    """
+    Depth of node below root, root has to be an ancestor of node or node itself.
+    """
+    return get_depth(node) - get_depth(root)
+
+
+def get_depth(node: Node) -> int:
+    """
+    Number of ancestors of the node, i.e. 0 for the document itself.
+    """
+    if node.page is not None:
+        return node.page.get_depth(node.node_id)
+    return sum(1 for _ in node.soup.parents)
 
-    # depth of root
-    i = node_parents.index(root.soup)
 
-    # depth of element
-    j = len(node_parents)
+def get_node_bits(node_ids: typing.Iterable[int]) -> int:
+    """
+    Bitset with the bits of the given node ids set.
+    """
+    node_ids = list(node_ids)
+    if not node_ids:
+        return 0
+
+    # one byte per eight nodes, setting bits of an int copies it every time
+    bitmap = bytearray(max(node_ids) // 8 + 1)
+    for node_id in node_ids:
+        bitmap[node_id >> 3] |= 1 << (node_id & 7)
+    return int.from_bytes(bitmap, "little")
+
+
+def generate_node_ids(bits: int) -> typing.Generator[int, None, None]:
+    """
+    Ids of the nodes in a bitset, in increasing order.
+    """
+    while bits:
+        lowest_bit = bits & -bits
+        yield lowest_bit.bit_length() - 1
+        bits ^= lowest_bit
+
+
+def count_nodes(bits: int) -> int:
+    return bin(bits).count("1")
+
+
+def get_common_ancestor(nodes: typing.List[Node]) -> Node:
+    """
+    Lowest node that is an ancestor (or the node itself) of all given nodes.
+    """
+    page = nodes[0].page
+    if page is None or any(n.page is not page for n in nodes):
+        return nodes[0].get_node(_get_root_of_nodes([n.soup for n in nodes]))
 
-    return j - i
+    ancestor_id = page.get_common_ancestor_id(n.node_id for n in nodes)
+    return page.get_node_by_id(ancestor_id)
@@ -0,0 +1,325 @@
+"""
+Scrape-time page backend on top of lxml.html.
+
+Training needs the soup based Page and its indexes, scraping only needs
+select, text and attributes. LxmlPage keeps the libxml2 tree without building
+a soup and evaluates CSS rules as compiled XPath expressions inside libxml2.
+Rules are translated from the path selector subset in mlscraper.css.
+"""
+
+import re
+import typing
+from functools import lru_cache
+
+import lxml.html
+from bs4.builder import HTMLTreeBuilder
+from bs4.dammit import UnicodeDammit
+from lxml import etree
+
+from mlscraper.css import Compound, parse_path_selector
+
+# soup conventions, mirrored to extract the same values as from soup pages
+# attributes split into lists of values
+CDATA_LIST_ATTRIBUTES = HTMLTreeBuilder.DEFAULT_CDATA_LIST_ATTRIBUTES
+# tags whose strings only count for their own text, e.g. script
+STRING_CONTAINER_TAGS = frozenset(HTMLTreeBuilder.DEFAULT_STRING_CONTAINERS)
+# tags keeping whitespace-only strings, soup collapses them everywhere else
+PRESERVE_WHITESPACE_TAGS = frozenset(HTMLTreeBuilder.DEFAULT_PRESERVE_WHITESPACE_TAGS)
+ASCII_SPACES = "\x20\x0a\x09\x0c\x0d"
+
+# characters fed to the parser at once when parsing only a prefix of a page
+PREFIX_CHUNK_SIZE = 1 << 14
+
+_EXTENSIONS_NAMESPACE = "urn:mlscraper:xpath"
+
+# lxml refuses str input declaring an encoding, the str is decoded already
+_XML_DECLARATION_RE = re.compile(r"^\s*<\?xml[^>]*\?>")
+
+
+class XPathTranslationException(Exception):
+    pass
+
+
+def css_to_xpath(css_rule: str) -> str:
+    """
+    Translate a CSS rule into an XPath step selecting matching descendants.
+
+    Like soupsieve, ancestors may lie above the element select is called on.
+    """
+    compounds = parse_path_selector(css_rule)
+    if compounds is None:
+        raise XPathTranslationException(f"unsupported css rule: {css_rule}")
+
+    # "a b c" selects c with an ancestor b that has an ancestor a
+    *ancestor_compounds, compound = compounds
+    predicate = ""
+    for ancestor_compound in ancestor_compounds:
+        predicate = f"[ancestor::*{_translate_compound(ancestor_compound)}{predicate}]"
+    return f"*{_translate_compound(compound)}{predicate}"
+
+
+def _translate_compound(compound: Compound) -> str:
+    conditions = []
+    if compound.tag is not None:
+        conditions.append(f"self::{compound.tag}")
+    conditions += [f"@id={_make_literal(tag_id)}" for tag_id in compound.ids]
+    conditions += [
+        "contains(concat(' ', normalize-space(@class), ' '),"
+        f" {_make_literal(f' {css_class} ')})"
+        for css_class in compound.classes
+    ]
+    conditions += [
+        f"count(preceding-sibling::*)={position - 1}"
+        for position in compound.child_positions
+    ]
+    for position in compound.type_positions:
+        if compound.tag is not None:
+            conditions.append(
+                f"count(preceding-sibling::{compound.tag})={position - 1}"
+            )
+        else:
+            # xpath 1.0 cannot compare siblings to the context node by name
+            conditions.append(f"mls:type-position()={position}")
+    return "".join(f"[{condition}]" for condition in conditions)
+
+
+def _make_literal(value: str) -> str:
+    # xpath 1.0 strings cannot escape quotes, values with both are concatenated
+    if "'" not in value:
+        return f"'{value}'"
+    if '"' not in value:
+        return f'"{value}"'
+
+    pieces = []
+    for i, part in enumerate(value.split("'")):
+        if i:
+            pieces.append('"\'"')
+        if part:
+            pieces.append(f"'{part}'")
+    return f"concat({', '.join(pieces)})"
+
+
+def _get_type_position(context) -> int:
+    element = context.context_node
+    tag = element.tag
+    return 1 + sum(1 for s in element.itersiblings(preceding=True) if s.tag == tag)
+
+
+@lru_cache(maxsize=4096)
+def compile_css_rule(css_rule: str) -> typing.Tuple[etree.XPath, etree.XPath]:
+    """
+    Compile a CSS rule into XPath expressions for elements and for pages.
+
+    Pages are evaluated on the root element, which can match itself.
+    """
+    step = css_to_xpath(css_rule)
+    return (
+        _compile_xpath(f"descendant::{step}"),
+        _compile_xpath(f"descendant-or-self::{step}"),
+    )
+
+
+@lru_cache(maxsize=4096)
+def compile_css_match(css_rule: str) -> etree.XPath:
+    """
+    Compile a CSS rule into an XPath expression testing the context element.
+    """
+    return _compile_xpath(f"boolean(self::{css_to_xpath(css_rule)})")
+
+
+def _compile_xpath(expression: str) -> etree.XPath:
+    return etree.XPath(
+        expression,
+        namespaces={"mls": _EXTENSIONS_NAMESPACE},
+        extensions={(_EXTENSIONS_NAMESPACE, "type-position"): _get_type_position},
+        smart_strings=False,
+    )
+
+
+def _generate_strings(element) -> typing.Generator[str, None, None]:
+    """
+    Strings below the element that soup includes in its text.
+
+    Strings belong to the innermost string container tag around them,
+    a tag only yields the strings of its own container.
+    """
+    container = None
+    preserve = False
+    for tag in (element, *element.iterancestors()):
+        if container is None and tag.tag in STRING_CONTAINER_TAGS:
+            container = tag.tag
+        preserve = preserve or tag.tag in PRESERVE_WHITESPACE_TAGS
+    kind = element.tag if element.tag in STRING_CONTAINER_TAGS else None
+
+    if element.text and container == kind:
+        yield _normalize_string(element.text, preserve)
+
+    # (children, container, preserve, tail of the parent to yield afterwards)
+    stack = [(iter(element), container, preserve, None)]
+    while stack:
+        children, container, preserve, tail = stack[-1]
+        child = next(children, None)
+        if child is None:
+            stack.pop()
+            if tail:
+                yield tail
+            continue
+
+        child_tail = None
+        if child.tail and container == kind:
+            child_tail = _normalize_string(child.tail, preserve)
+
+        # comments and processing instructions only contribute their tail
+        if not isinstance(child.tag, str):
+            if child_tail:
+                yield child_tail
+            continue
+
+        child_container = child.tag if child.tag in STRING_CONTAINER_TAGS else container
+        if kind is None and child_container is not None:
+            # containers never end below a container, skip the whole subtree
+            if child_tail:
+                yield child_tail
+            continue
+
+        child_preserve = preserve or child.tag in PRESERVE_WHITESPACE_TAGS
+        if child.text and child_container == kind:
+            yield _normalize_string(child.text, child_preserve)
+        stack.append((iter(child), child_container, child_preserve, child_tail))
+
+
+def _normalize_string(string: str, preserve: bool) -> str:
+    # soup collapses whitespace-only strings to a newline or a space
+    if preserve or string.strip(ASCII_SPACES):
+        return string
+    return "\n" if "\n" in string else " "
+
+
+class LxmlNode:
+    element = None
+    _page = None
+
+    def __init__(self, element, page=None):
+        self.element = element
+        self._page = page
+
+    def get_page(self):
+        return self._page
+
+    page = property(get_page)
+
+    def get_node(self, element):
+        """
+        Get the node for another element of the same page.
+        """
+        return LxmlNode(element, self.page)
+
+    def get_root(self):
+        return self.page
+
+    def get_text(self):
+        return "".join(_generate_strings(self.element))
+
+    text = property(get_text)
+
+    def get_attribute(self, attr: str):
+        value = self.element.get(attr)
+        if value is not None and self._is_list_attribute(attr):
+            return value.split()
+        return value
+
+    def _is_list_attribute(self, attr: str) -> bool:
+        return attr in CDATA_LIST_ATTRIBUTES["*"] or attr in CDATA_LIST_ATTRIBUTES.get(
+            self.element.tag, ()
+        )
+
+    def select(self, css_rule: str) -> typing.List["LxmlNode"]:
+        xpath, _ = compile_css_rule(css_rule)
+        return [self.get_node(element) for element in xpath(self.element)]
+
+    def __eq__(self, other):
+        return isinstance(other, LxmlNode) and self.element is other.element
+
+    def __hash__(self):
+        return hash(self.element)
+
+    def __repr__(self):
+        return f"<{self.__class__.__name__} {self.element=}>"
+
+
+class LxmlPage(LxmlNode):
+    """
+    Page parsed by lxml only, for scraping with trained scrapers.
+
+    With required_rules, the page is only parsed until the first match of every
+    rule is complete. Everything up to these elements is the same as in the
+    full page, so selecting the first match of a rule gives the same element.
+    """
+
+    parsed_length = None
+
+    def __init__(self, html, required_rules: typing.Optional[list] = None):
+        if isinstance(html, bytes):
+            # decoded like soup does it, lxml assumes latin-1 without a charset
+            html = UnicodeDammit(html, is_html=True).unicode_markup
+        if required_rules is None:
+            element = self._parse(html)
+        else:
+            element = self._parse_prefix(html, required_rules)
+        super().__init__(element, self)
+
+    def _parse(self, html):
+        self.parsed_length = len(html)
+        html = _XML_DECLARATION_RE.sub("", html, count=1)
+        try:
+            return lxml.html.document_fromstring(html)
+        except etree.ParserError:
+            # empty documents are pages without elements for soup
+            return None
+
+    def _parse_prefix(self, html, required_rules: list):
+        self.parsed_length = 0
+        matchers = [compile_css_match(css_rule) for css_rule in set(required_rules)]
+        # elements matched first by a rule, waiting for their end tag
+        pending = set()
+
+        parser = etree.HTMLPullParser(events=("start", "end"))
+        for chunk_start in range(0, len(html), PREFIX_CHUNK_SIZE):
+            chunk_end = chunk_start + PREFIX_CHUNK_SIZE
+            parser.feed(html[chunk_start:chunk_end])
+            self.parsed_length = min(chunk_end, len(html))
+
+            for event, element in parser.read_events():
+                if event == "end":
+                    pending.discard(element)
+                    continue
+
+                # match at the start tag, the first start is the first match
+                matched = [m for m in matchers if m(element)]
+                if matched:
+                    matchers = [m for m in matchers if m not in matched]
+                    pending.add(element)
+
+            if not matchers and not pending:
+                break
+
+        try:
+            return parser.close()
+        except etree.XMLSyntaxError:
+            return None
+
+    def get_text(self):
+        if self.element is None:
+            return ""
+        return super().get_text()
+
+    text = property(get_text)
+
+    def select(self, css_rule: str) -> typing.List[LxmlNode]:
+        _, xpath = compile_css_rule(css_rule)
+        if self.element is None:
+            return []
+        return [self.get_node(element) for element in xpath(self.element)]
+
+    def __repr__(self):
+        return f"<{self.__class__.__name__}>"
@@ -0,0 +1,26 @@
+import pytest
+
+from mlscraper.samples import make_training_set
+from mlscraper.util import Page
+
+
+@pytest.fixture
+def make_article_training_set():
+    """
+    Factory of fresh training sets of two article pages with title, author and link.
+    """
+
+    def make():
+        pages = [
+            Page(
+                f'<html><body><h1 class="title">t{i}</h1><p class="author">a{i}</p>'
+                f'<a href="/l{i}">link</a></body></html>'
+            )
+            for i in range(2)
+        ]
+        items = [
+            {"title": f"t{i}", "author": f"a{i}", "link": f"/l{i}"} for i in range(2)
+        ]
+        return make_training_set(pages, items)
+
+    return make
@@ -0,0 +1,113 @@
+import os
+
+import pytest
+
+from mlscraper import training
+from mlscraper.cache import ScraperCache, get_training_fingerprint
+from mlscraper.samples import make_training_set
+from mlscraper.scrapers import ValueScraper
+from mlscraper.training import train_scraper
+from mlscraper.util import CssRuleSelector, Page, get_text_extractor
+
+
+def make_pages_and_items(title="t"):
+    pages = [
+        Page(f'<html><body><h1 class="title">{title}{i}</h1><p>x</p></body></html>')
+        for i in range(2)
+    ]
+    items = [{"title": f"{title}{i}"} for i in range(2)]
+    return pages, items
+
+
+def test_fingerprint():
+    pages, items = make_pages_and_items()
+    item = make_training_set(pages, items).item
+    fingerprint = get_training_fingerprint(item, {"a": 1})
+
+    # same data parsed again, different values, pages or parameters
+    assert (
+        get_training_fingerprint(
+            make_training_set(*make_pages_and_items()).item, {"a": 1}
+        )
+        == fingerprint
+    )
+    assert get_training_fingerprint(item, {"a": 2}) != fingerprint
+    other_pages, other_items = make_pages_and_items("u")
+    assert (
+        get_training_fingerprint(
+            make_training_set(other_pages, other_items).item, {"a": 1}
+        )
+        != fingerprint
+    )
+
+
+def test_fingerprint_bytes():
+    html = '<html><body><h1 class="title">t0</h1></body></html>'
+    items = [{"title": "t0"}]
+    item = make_training_set([Page(html)], items).item
+    item_from_bytes = make_training_set([Page(html.encode())], items).item
+    assert get_training_fingerprint(item_from_bytes, {}) == get_training_fingerprint(
+        item, {}
+    )
+
+
+def test_cache_put_get(tmp_path):
+    cache = ScraperCache(tmp_path)
+    assert cache.get("a") is None
+
+    scraper = ValueScraper(CssRuleSelector("h1"), get_text_extractor())
+    cache.put("a", scraper)
+    assert repr(ScraperCache(tmp_path).get("a")) == repr(scraper)
+    assert (cache.hits, cache.misses) == (0, 1)
+
+    (tmp_path / "b.json").write_text("garbage")
+    assert cache.get("b") is None
+    assert len(cache) == 1
+
+
+def test_cache_eviction(tmp_path):
+    scraper = ValueScraper(CssRuleSelector("h1"), get_text_extractor())
+    cache = ScraperCache(tmp_path, max_size=10**6)
+    for i, fingerprint in enumerate("abc"):
+        cache.put(fingerprint, scraper)
+        os.utime(tmp_path / f"{fingerprint}.json", (i, i))
+    entry_size = (tmp_path / "a.json").stat().st_size
+
+    # reading a refreshes it, so b is the least recently used
+    cache.get("a")
+    cache.max_size = 2 * entry_size
+    cache.evict()
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["a.json", "c.json"]
+
+
+def test_train_scraper_cached(tmp_path, monkeypatch):
+    pages, items = make_pages_and_items()
+    cache = ScraperCache(tmp_path)
+    scraper = train_scraper(make_training_set(pages, items).item, cache=cache)
+    assert len(cache) == 1
+
+    def fail(*args, **kwargs):
+        pytest.fail("searched although the scraper is cached")
+
+    monkeypatch.setattr(training, "make_matcher_for_samples", fail)
+    pages, items = make_pages_and_items()
+    cached = train_scraper(make_training_set(pages, items).item, cache=cache)
+    assert repr(cached) == repr(scraper)
+    assert [cached.get(p) for p in pages] == items
+
+
+def test_cache_temporary_files(tmp_path):
+    scraper = ValueScraper(CssRuleSelector("h1"), get_text_extractor())
+    cache = ScraperCache(tmp_path, max_size=10**6)
+    cache.put("a", scraper)
+    entry_size = (tmp_path / "a.json").stat().st_size
+
+    # one write interrupted long ago, one in progress
+    (tmp_path / "stale.tmp").write_text("x" * entry_size)
+    os.utime(tmp_path / "stale.tmp", (0, 0))
+    (tmp_path / "pending.tmp").write_text("x" * entry_size)
+
+    # the pending write counts toward the size
+    cache.max_size = entry_size
+    cache.evict()
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["pending.tmp"]
@@ -0,0 +1,158 @@
+import gzip
+import json
+
+import pytest
+
+from mlscraper.corpus import (
+    CorpusFormatException,
+    read_corpus,
+    read_directory,
+    read_jsonl,
+    read_warc,
+)
+from mlscraper.util import Page
+
+
+def make_warc_record(warc_type, uri, block):
+    headers = (
+        "WARC/1.0\r\n"
+        f"WARC-Type: {warc_type}\r\n"
+        f"WARC-Target-URI: {uri}\r\n"
+        "Content-Type: application/http; msgtype=response\r\n"
+        f"Content-Length: {len(block)}\r\n"
+        "\r\n"
+    )
+    return headers.encode() + block + b"\r\n\r\n"
+
+
+def make_http_response(body, content_type="text/html; charset=utf-8", chunked=False):
+    headers = f"HTTP/1.1 200 OK\r\nContent-Type: {content_type}\r\n"
+    if chunked:
+        headers += "Transfer-Encoding: chunked\r\n"
+        body = b"".join(
+            b"%x\r\n%s\r\n" % (len(part), part) for part in (body[:5], body[5:])
+        )
+        body += b"0\r\n\r\n"
+    return headers.encode() + b"\r\n" + body
+
+
+@pytest.fixture
+def warc_records():
+    return [
+        make_warc_record("request", "http://a.com/", b"GET / HTTP/1.1\r\n\r\n"),
+        make_warc_record(
+            "response", "http://a.com/", make_http_response("<p>ä</p>".encode())
+        ),
+        make_warc_record(
+            "response",
+            "http://a.com/img",
+            make_http_response(b"\x89PNG", content_type="image/png"),
+        ),
+        make_warc_record(
+            "response",
+            "http://b.com/",
+            make_http_response(b"<p>chunked</p>", chunked=True),
+        ),
+    ]
+
+
+def test_read_warc(tmp_path, warc_records):
+    path = tmp_path / "crawl.warc"
+    path.write_bytes(b"".join(warc_records))
+
+    documents = list(read_warc(path, parse=False))
+    assert documents == [
+        ("http://a.com/", "<p>ä</p>"),
+        ("http://b.com/", "<p>chunked</p>"),
+    ]
+
+
+def test_read_warc_gz(tmp_path, warc_records):
+    # one gzip member per record
+    path = tmp_path / "crawl.warc.gz"
+    path.write_bytes(b"".join(gzip.compress(record) for record in warc_records))
+
+    documents = list(read_corpus(path))
+    assert [url for url, _ in documents] == ["http://a.com/", "http://b.com/"]
+    assert all(isinstance(page, Page) for _, page in documents)
+    assert documents[1][1].select("p")[0].text == "chunked"
+
+
+def test_read_warc_invalid(tmp_path):
+    path = tmp_path / "crawl.warc"
+    path.write_bytes(b"<html></html>")
+    with pytest.raises(CorpusFormatException):
+        list(read_warc(path))
+
+
+def test_read_warc_invalid_chunked(tmp_path, warc_records):
+    bad_chunks = b"HTTP/1.1 200 OK\r\nContent-Type: text/html\r\n"
+    bad_chunks += b"Transfer-Encoding: chunked\r\n\r\nzz\r\n<p>x</p>\r\n0\r\n\r\n"
+    path = tmp_path / "crawl.warc"
+    path.write_bytes(
+        make_warc_record("response", "http://c.com/", bad_chunks)
+        + b"".join(warc_records)
+    )
+
+    documents = list(read_warc(path, parse=False))
+    assert [url for url, _ in documents] == ["http://a.com/", "http://b.com/"]
+
+
+def test_read_jsonl(tmp_path):
+    path = tmp_path / "pages.jsonl.gz"
+    lines = [
+        json.dumps({"url": f"http://a.com/{i}", "html": f"<p>{i}</p>"}) + "\n"
+        for i in range(3)
+    ]
+    path.write_bytes(gzip.compress("\n".join(lines).encode()))
+
+    documents = read_jsonl(path)
+    assert [(url, page.select("p")[0].text) for url, page in documents] == [
+        (f"http://a.com/{i}", str(i)) for i in range(3)
+    ]
+
+
+@pytest.mark.parametrize("line", ['{"url": "http://a.com/"}', '["<p>a</p>"]'])
+def test_read_jsonl_invalid_document(tmp_path, line):
+    path = tmp_path / "pages.jsonl"
+    path.write_text('{"html": "<p>a</p>"}\n' + line + "\n")
+
+    documents = read_jsonl(path)
+    next(documents)
+    with pytest.raises(CorpusFormatException, match=f"{path}:2"):
+        next(documents)
+
+
+def test_read_directory(tmp_path):
+    (tmp_path / "sub").mkdir()
+    (tmp_path / "b.html").write_text("<p>b</p>")
+    (tmp_path / "sub" / "a.html").write_text("<p>a</p>")
+    (tmp_path / "notes.txt").write_text("no html")
+
+    documents = list(read_directory(tmp_path, parse=False))
+    assert [html for _, html in documents] == [b"<p>b</p>", b"<p>a</p>"]
+    assert documents[0][0] == (tmp_path / "b.html").resolve().as_uri()
+
+    documents = list(read_directory(tmp_path, parse=False, encoding="utf-8"))
+    assert [html for _, html in documents] == ["<p>b</p>", "<p>a</p>"]
+
+
+def test_read_directory_detects_charset(tmp_path):
+    html = '<html><head><meta charset="iso-8859-1"></head><body><p>é</p></body></html>'
+    (tmp_path / "a.html").write_bytes(html.encode("latin-1"))
+
+    ((_, page),) = read_directory(tmp_path)
+    assert page.select("p")[0].text == "é"
+
+
+def test_read_corpus_unknown_format(tmp_path):
+    with pytest.raises(CorpusFormatException):
+        read_corpus(tmp_path / "pages.csv")
+
+
+def test_read_corpus_arc_unsupported(tmp_path):
+    # ARC records have no WARC headers, so they are not read as WARC
+    path = tmp_path / "crawl.arc.gz"
+    path.write_bytes(b"")
+    with pytest.raises(CorpusFormatException):
+        read_corpus(path)
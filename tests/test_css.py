@@ -0,0 +1,64 @@
+import pytest
+
+from mlscraper.css import Compound, parse_path_selector
+from mlscraper.util import Page
+
+
+def test_parse_path_selector():
+    assert parse_path_selector("div.a.b :nth-child(2) #x") == (
+        Compound("div", (), ("a", "b"), (), ()),
+        Compound(None, (), (), (2,), ()),
+        Compound(None, ("x",), (), (), ()),
+    )
+    assert parse_path_selector("P:nth-of-type(1)") == (Compound("p", (), (), (), (1,)),)
+
+
+def test_parse_path_selector_identifiers():
+    # non-ascii characters and escapes, a hex escape ends with one space
+    assert parse_path_selector("p.über #a\\:b .\\31 a") == (
+        Compound("p", (), ("über",), (), ()),
+        Compound(None, ("a:b",), (), (), ()),
+        Compound(None, (), ("1a",), (), ()),
+    )
+
+
+@pytest.mark.parametrize(
+    "css_selector", ["div > p", "a[href]", "p:first-child", "div.md:w-auto", "#1", ""]
+)
+def test_parse_path_selector_unsupported(css_selector):
+    assert parse_path_selector(css_selector) is None
+
+
+def test_select_same_as_soupsieve():
+    page = Page(
+        "<html><body>"
+        '<div id="main" class="x y"><p class="x">1</p><p>2</p>'
+        '<div class="y"><span>3</span><p class="x z">4</p></div></div>'
+        '<ul><li class="x"><p>5</p></li><li><span class="x">6</span></li></ul>'
+        '<p class="über">7</p><p class="1a">8</p>'
+        "</body></html>"
+    )
+    css_selectors = [
+        "p",
+        ".x",
+        "p.x.z",
+        "#main p",
+        "div div p",
+        ".y .y p",
+        ":nth-child(1)",
+        ":nth-of-type(2)",
+        "li:nth-child(2) span",
+        ":nth-child(1) :nth-child(1)",
+        "ul .x p",
+        "html body",
+        "body :nth-child(2)",
+        "section p",
+        "p.über",
+        ".\\31 a",
+    ]
+    roots = [page] + page.select("div") + page.select("li")
+    for css_selector in css_selectors:
+        assert parse_path_selector(css_selector) is not None
+        for root in roots:
+            expected = [root.get_node(n) for n in root.soup.select(css_selector)]
+            assert root.select(css_selector) == expected, css_selector
@@ -0,0 +1,82 @@
+import pytest
+
+from mlscraper.plans import PlanCompilationException, compile_scraper
+from mlscraper.scrapers import DictScraper, ListScraper, Scraper, ValueScraper
+from mlscraper.selectors import CssRuleSelector
+from mlscraper.util import AttributeValueExtractor, Page, TextValueExtractor
+from mlscraper.xpath import LxmlPage
+
+
+@pytest.fixture
+def stackoverflow_page():
+    with open("tests/static/so.html") as file:
+        return Page(file.read())
+
+
+def test_plan_list_of_dicts(stackoverflow_page):
+    scraper = ListScraper(
+        CssRuleSelector(".answer"),
+        DictScraper(
+            {
+                "user": ValueScraper(
+                    CssRuleSelector(".user-details a"), AttributeValueExtractor("href")
+                ),
+                "upvotes": ValueScraper(
+                    CssRuleSelector(".js-vote-count"), TextValueExtractor()
+                ),
+                "when": ValueScraper(
+                    CssRuleSelector(".user-action-time span"),
+                    AttributeValueExtractor("title"),
+                ),
+            }
+        ),
+    )
+    plan = compile_scraper(scraper)
+    assert plan.get(stackoverflow_page) == scraper.get(stackoverflow_page)
+
+
+def test_plan_ancestor_outside_scope():
+    # selectors are matched in the context of the whole document
+    html = "<html><body><div class='a'><p><span>1</span></p><p><span>2</span></p></div></body></html>"
+    page = Page(html)
+    scraper = ListScraper(
+        CssRuleSelector("p"),
+        ValueScraper(CssRuleSelector(".a span"), TextValueExtractor()),
+    )
+    assert compile_scraper(scraper).get(page) == ["1", "2"] == scraper.get(page)
+
+
+def test_plan_missing_value():
+    page = Page("<html><body><p>1</p></body></html>")
+    scraper = ValueScraper(CssRuleSelector("h1"), TextValueExtractor())
+    with pytest.raises(IndexError):
+        compile_scraper(scraper).get(page)
+
+
+def test_plan_unsupported_scraper():
+    with pytest.raises(PlanCompilationException):
+        compile_scraper(Scraper())
+
+
+def test_plan_fallbacks():
+    html = (
+        "<html><body><ul><li><b>1</b><i>a</i></li><li><b>2</b><i>b</i></li></ul>"
+        "<ul><li><b>3</b><i>c</i></li></ul></body></html>"
+    )
+    scraper = ListScraper(
+        CssRuleSelector("li"),
+        DictScraper(
+            {
+                "b": ValueScraper(CssRuleSelector("li > b"), TextValueExtractor()),
+                "i": ValueScraper(CssRuleSelector("i"), TextValueExtractor()),
+            }
+        ),
+    )
+    plan = compile_scraper(scraper)
+    expected = [{"b": "1", "i": "a"}, {"b": "2", "i": "b"}, {"b": "3", "i": "c"}]
+
+    # rules outside the path selector subset are selected with soupsieve
+    assert plan.get(Page(html)) == expected == scraper.get(Page(html))
+    # nodes of other backends are scraped with the scraper tree
+    value_scraper = ValueScraper(CssRuleSelector("ul i"), TextValueExtractor())
+    assert compile_scraper(value_scraper).get(LxmlPage(html)) == "a"
@@ -1,6 +1,13 @@
+from types import GeneratorType
+
 import pytest
 
-from mlscraper.samples import ItemStructureException, Sample, make_training_set
+from mlscraper.samples import (
+    ItemStructureException,
+    Sample,
+    make_training_set,
+    match_cache,
+)
 from mlscraper.util import DictMatch, ListMatch, Page
 
 
@@ -33,8 +40,8 @@ class TestMatch:
         sample = Sample(page, ["1", "2", "2", "4"])
         matches = sample.get_matches()
 
-        # todo check duplicate generation
-        # assert len(matches) == 2
+        # both 2s can't be matched to the same node
+        assert len(matches) == 2
         assert all(isinstance(m, ListMatch) for m in matches)
 
     def test_get_matches_list_of_dicts(self):
@@ -61,3 +68,33 @@ class TestMatch:
         assert all(isinstance(m, DictMatch) for m in match.matches)
         print(match.get_root())
         print(match.get_span())
+
+
+def test_get_matches_cached():
+    page = Page("<html><body><p>a</p><p>b</p></body></html>")
+    match_cache.clear()
+
+    matches = Sample(page, "a").get_matches()
+    # combinations are not cached, only the matches of their values
+    Sample(page, ["a", "b"]).get_matches()
+    assert match_cache.get_info().misses == 2
+    assert Sample(page, "a").get_matches() is matches
+    assert match_cache.get_info().hits == 2
+
+    # same value on another page is computed separately
+    other_page = Page("<html><body><p>a</p><p>b</p></body></html>")
+    assert Sample(other_page, "a").get_matches() is not matches
+
+
+def test_generate_matches():
+    page = Page(
+        "<html><body><ul><li>a</li><li>a</li><li>b</li></ul>"
+        "<ol><li>a</li></ol></body></html>"
+    )
+    sample = Sample(page, ["a", "a", "b"])
+
+    # built one at a time, in the order of get_matches
+    matches = sample.generate_matches()
+    assert isinstance(matches, GeneratorType)
+    assert [m.matches for m in matches] == [m.matches for m in sample.get_matches()]
+    assert len(sample.get_matches()) == 6
@@ -86,3 +86,53 @@ class TestValueScraper:
         vs = ValueScraper(CssRuleSelector(".test"), TextValueExtractor())
         assert vs.get(page1) == "test"
         assert vs.get(page2) == "hallo"
+
+
+class TestBatchScraping:
+    def test_scrape_iter(self):
+        htmls = [
+            f'<html><body><p class="test">{i}</p><p>bla</p></body></html>'
+            for i in range(20)
+        ]
+        vs = ValueScraper(CssRuleSelector(".test"), TextValueExtractor())
+        expected = [str(i) for i in range(20)]
+
+        # results keep input order, also for lazy input
+        assert vs.get_many(htmls, n_jobs=1) == expected
+        assert vs.get_many(iter(htmls), n_jobs=2, max_in_flight=3) == expected
+
+    def test_scrape_iter_lxml(self):
+        htmls = [f'<html><body><p class="test">{i}</p></body></html>' for i in range(5)]
+        vs = ValueScraper(CssRuleSelector(".test"), TextValueExtractor())
+        expected = [str(i) for i in range(5)]
+
+        assert vs.get_many(htmls, n_jobs=1, backend="lxml") == expected
+        assert vs.get_many(htmls, n_jobs=2, backend="lxml") == expected
+
+    def test_scrape_iter_partial(self):
+        scraper = DictScraper(
+            {
+                "title": ValueScraper(CssRuleSelector("h1"), TextValueExtractor()),
+                "link": ValueScraper(
+                    CssRuleSelector(".link"), AttributeValueExtractor("href")
+                ),
+            }
+        )
+        assert sorted(scraper.get_required_rules()) == [".link", "h1"]
+        assert ListScraper(CssRuleSelector("p"), scraper).get_required_rules() is None
+
+        htmls = [
+            f"<html><body><h1>{i}</h1><a class='link' href='/{i}'>x</a>"
+            + "<p>filler</p>" * 2000
+            + "</body></html>"
+            for i in range(3)
+        ]
+        expected = [{"title": str(i), "link": f"/{i}"} for i in range(3)]
+        assert scraper.get_many(htmls, n_jobs=1, backend="lxml", partial=True) == (
+            expected
+        )
+        assert scraper.get_many(htmls, n_jobs=2, backend="lxml", partial=True) == (
+            expected
+        )
+        with pytest.raises(ValueError):
+            scraper.get_many(htmls, n_jobs=1, partial=True)
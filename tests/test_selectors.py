@@ -1,12 +1,20 @@
+import gc
+import weakref
+
 import pytest
 
 from mlscraper.samples import Sample
 from mlscraper.selectors import (
+    SELECTOR_FAILS,
+    SELECTOR_TOO_BROAD,
     generate_matchers_for_samples,
     generate_selector_for_nodes,
     make_matcher_for_samples,
+    search_path_selectors,
+    select_node_bits,
+    selection_bits_cache,
 )
-from mlscraper.util import Page
+from mlscraper.util import AttributeValueExtractor, Page, TextValueExtractor
 
 
 def test_make_matcher_for_samples():
@@ -46,3 +54,89 @@ def test_generate_selector_for_nodes():
     gen = generate_selector_for_nodes(nodes, None)
     # todo .test is also possible
     assert ["p.test"] == [sel.css_rule for sel in gen]
+
+
+def test_generate_matchers_for_samples_extractors():
+    pages = [
+        Page(f'<html><body><p class="t">{v}</p><a title="{v}">x</a></body></html>')
+        for v in ["1", "2"]
+    ]
+    samples = [Sample(page, v) for page, v in zip(pages, ["1", "2"])]
+    matchers = list(generate_matchers_for_samples(samples))
+    extractor_per_rule = {m.selector.css_rule: m.extractor for m in matchers}
+
+    assert isinstance(extractor_per_rule["p.t"], TextValueExtractor)
+    assert isinstance(extractor_per_rule["a"], AttributeValueExtractor)
+    # each selector is tested and yielded once
+    assert len(extractor_per_rule) == len(matchers)
+
+
+def test_select_node_bits_cached():
+    page = Page('<html><body><p class="test">test</p><p>bla</p></body></html>')
+    selection_bits_cache.clear()
+
+    bits = select_node_bits(page, "p")
+    assert bits == sum(1 << n.node_id for n in page.select("p"))
+    assert select_node_bits(page, "p") is bits
+    assert selection_bits_cache.get_info().hits == 1
+    assert selection_bits_cache.get_hit_rate() == 0.5
+
+
+def test_search_frees_pages():
+    pages = [Page(f'<html><body><p class="test">{i}</p></body></html>') for i in "ab"]
+    samples = [Sample(page, value) for page, value in zip(pages, "ab")]
+    assert make_matcher_for_samples(samples)
+
+    matchers = generate_matchers_for_samples(samples)
+    next(matchers)
+    matchers.close()
+
+    # caches of the search are dropped once the outermost search returns
+    page_refs = [weakref.ref(page) for page in pages]
+    del pages, samples
+    gc.collect()
+    assert all(page_ref() is None for page_ref in page_refs)
+
+
+def test_generate_matchers_for_samples_pages():
+    # node ids of the pages overlap, bits of different pages must not
+    pages = [
+        Page(f'<html><body><p>x</p><p class="v">{v}</p></body></html>')
+        for v in ["1", "2"]
+    ]
+    samples = [Sample(page, v) for page, v in zip(pages, ["1", "2"])]
+    matcher = next(generate_matchers_for_samples(samples))
+    assert matcher.selector.css_rule == "p.v"
+    assert [matcher.selector.select_one(p).text for p in pages] == ["1", "2"]
+
+
+def test_search_path_selectors_best_first():
+    page = Page(
+        '<html><body><div class="a"><p>x</p></div><div class="b"><p>y</p></div></body></html>'
+    )
+    node = page.select("div.a p")[0]
+    selectors = [s.css_rule for s in generate_selector_for_nodes([node], [page])]
+    assert selectors[0] == "div.a p"
+
+
+def test_search_path_selectors_budget():
+    page = Page("<html><body><div><p>x</p></div><div><p>y</p></div></body></html>")
+    node = page.select("p")[0]
+    evaluated = []
+
+    def evaluate(css_selector):
+        evaluated.append(css_selector)
+        return SELECTOR_TOO_BROAD
+
+    assert list(search_path_selectors([node], evaluate, max_candidates=5)) == []
+    assert len(evaluated) == 5
+
+    # failing candidates are not extended with ancestors
+    evaluated.clear()
+
+    def evaluate_failing(css_selector):
+        evaluated.append(css_selector)
+        return SELECTOR_FAILS
+
+    list(search_path_selectors([node], evaluate_failing, max_candidates=None))
+    assert evaluated == ["p", ":nth-child(1)", ":nth-of-type(1)"]
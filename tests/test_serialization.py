@@ -0,0 +1,91 @@
+import subprocess
+import sys
+
+import pytest
+
+from mlscraper.scrapers import DictScraper, ListScraper, ValueScraper
+from mlscraper.serialization import (
+    SerializationException,
+    dumps_scraper,
+    load_scraper,
+    loads_scraper,
+    save_scraper,
+)
+from mlscraper.util import (
+    AttributeValueExtractor,
+    CssRuleSelector,
+    Page,
+    TextValueExtractor,
+    get_text_extractor,
+)
+
+
+@pytest.fixture
+def scraper():
+    return ListScraper(
+        CssRuleSelector(".answer"),
+        DictScraper(
+            {
+                "user": ValueScraper(
+                    CssRuleSelector(".user-details a"), AttributeValueExtractor("href")
+                ),
+                "upvotes": ValueScraper(
+                    CssRuleSelector(".js-vote-count"), TextValueExtractor()
+                ),
+            }
+        ),
+    )
+
+
+def test_roundtrip(scraper, tmp_path):
+    with open("tests/static/so.html") as file:
+        page = Page(file.read())
+
+    data = dumps_scraper(scraper)
+    assert data == (
+        '{"version":1,"scraper":["list",".answer",["dict",'
+        '{"user":["value",".user-details a",["attr","href"]],'
+        '"upvotes":["value",".js-vote-count","text"]}]]}'
+    )
+    loaded = loads_scraper(data)
+    assert loaded.get(page) == scraper.get(page)
+    assert loaded.scraper.scraper_per_key["upvotes"].extractor is get_text_extractor()
+
+    path = tmp_path / "scraper.json"
+    save_scraper(scraper, path)
+    assert load_scraper(path, backend="lxml").get(page) == scraper.get(page)
+
+
+@pytest.mark.parametrize(
+    "data",
+    [
+        "no json",
+        '{"version":2,"scraper":["value","p","text"]}',
+        '{"version":1,"scraper":["value","p","html"]}',
+        '{"version":1,"scraper":["value","p"]}',
+        '{"version":1,"scraper":["table","p"]}',
+    ],
+)
+def test_loads_invalid(data):
+    with pytest.raises(SerializationException):
+        loads_scraper(data)
+
+
+def test_loads_unsupported_css_rule():
+    data = '{"version":1,"scraper":["value","div > p","text"]}'
+    assert loads_scraper(data).selector.css_rule == "div > p"
+    with pytest.raises(SerializationException):
+        loads_scraper(data, backend="lxml")
+    with pytest.raises(SerializationException):
+        loads_scraper('{"version":1,"scraper":["value","p[","text"]}')
+
+
+def test_load_without_training_modules(scraper):
+    code = (
+        "import sys\n"
+        "from mlscraper.serialization import loads_scraper\n"
+        f"loads_scraper({dumps_scraper(scraper)!r})\n"
+        "assert not {'mlscraper.samples', 'mlscraper.selectors', 'mlscraper.training'}"
+        " & set(sys.modules)\n"
+    )
+    subprocess.run([sys.executable, "-c", code], check=True)
@@ -0,0 +1,64 @@
+import json
+
+from mlscraper import tracing
+from mlscraper.tracing import ChromeTracer, Tracer, get_tracer, use_tracer
+from mlscraper.training import train_scraper
+
+
+def test_trace_training(tmp_path, make_article_training_set):
+    with use_tracer(ChromeTracer()) as tracer:
+        train_scraper(make_article_training_set().item)
+    assert not get_tracer().enabled
+
+    names = [event["name"] for event in tracer.events]
+    assert names == [
+        "train ValueItem",
+        "key title",
+        "train ValueItem",
+        "key author",
+        "train ValueItem",
+        "key link",
+        "train DictItem",
+    ]
+    value_event = tracer.events[0]
+    assert value_event["args"]["samples"] == 2
+    assert value_event["args"]["candidates evaluated"] >= 1
+    assert (
+        tracer.counts["candidates generated"] >= tracer.counts["candidates evaluated"]
+    )
+    assert tracer.counts["match cache misses"] >= 2
+
+    # spans contain their children
+    dict_event = tracer.events[-1]
+    assert all(e["ts"] >= dict_event["ts"] for e in tracer.events)
+    assert all(e["dur"] <= dict_event["dur"] for e in tracer.events)
+
+    path = tmp_path / "trace.json"
+    tracer.write(path)
+    assert len(json.loads(path.read_text())["traceEvents"]) == 7
+
+
+def test_trace_training_parallel(make_article_training_set):
+    with use_tracer(ChromeTracer()) as serial_tracer:
+        train_scraper(make_article_training_set().item)
+    with use_tracer(ChromeTracer()) as tracer:
+        train_scraper(make_article_training_set().item, n_jobs=2)
+
+    # spans and counts of the workers are merged into the parent
+    names = sorted(event["name"] for event in tracer.events)
+    assert names == sorted(event["name"] for event in serial_tracer.events)
+    assert tracer.counts == serial_tracer.counts
+    assert len({event["pid"] for event in tracer.events}) > 1
+
+
+def test_null_tracer():
+    tracer = Tracer()
+    with tracer.span("nothing", a=1):
+        tracer.count("nothing")
+
+    assert tracer.fork() is tracer
+    tracer.merge(tracer.get_records())
+
+    tracing.set_tracer(ChromeTracer())
+    tracing.set_tracer(None)
+    assert not get_tracer().enabled
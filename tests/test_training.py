@@ -1,8 +1,17 @@
+import gc
+import weakref
+
 import pytest
 
-from mlscraper.samples import make_training_set
-from mlscraper.training import train_scraper
-from mlscraper.util import Page
+from mlscraper import selectors, training
+from mlscraper.samples import Sample, make_training_set
+from mlscraper.selectors import SearchBudget, SearchBudgetExhaustedException
+from mlscraper.training import (
+    IncrementalTrainer,
+    get_smallest_span_match_per_sample,
+    train_scraper,
+)
+from mlscraper.util import Page, get_attribute_extractor
 
 
 @pytest.fixture
@@ -30,6 +39,172 @@ def stackoverflow_training_set():
     return make_training_set([page], [item])
 
 
-@pytest.mark.skip("not ready")
 def test_train_scraper(stackoverflow_training_set):
-    train_scraper(stackoverflow_training_set.item)
+    scraper = train_scraper(stackoverflow_training_set.item)
+    sample = stackoverflow_training_set.item.samples[0]
+    assert scraper.get(sample.page) == sample.value
+
+
+def test_get_smallest_span_match_per_sample():
+    page = Page(
+        "<html><body><div><p>a</p><p>b</p></div>"
+        "<p>a</p><div><div><p>b</p></div></div></body></html>"
+    )
+    sample = Sample(page, {"x": "a", "y": "b"})
+
+    (match,) = get_smallest_span_match_per_sample([sample])
+    assert match.get_span() == min(m.get_span() for m in sample.get_matches())
+    assert match.get_span() == 2
+
+
+def test_train_scraper_parallel(make_article_training_set):
+    training_set = make_article_training_set()
+    pages = [s.page for s in training_set.item.samples]
+    items = [s.value for s in training_set.item.samples]
+
+    serial = train_scraper(training_set.item)
+    parallel = train_scraper(training_set.item, n_jobs=2)
+    assert repr(parallel) == repr(serial)
+    assert [parallel.get(p) for p in pages] == items
+
+    # extractors stay unique when scrapers come back from workers
+    link_scraper = parallel.scraper_per_key["link"]
+    assert link_scraper.extractor is get_attribute_extractor("href")
+
+
+def test_incremental_trainer(monkeypatch):
+    def make_page(i, header=""):
+        return Page(
+            f'<html><body>{header}<div class="main"><h1 class="title">t{i}</h1>'
+            f'<p class="author">a{i}</p><p>x</p></div></body></html>'
+        )
+
+    searched = []
+
+    def generate_matchers_for_samples(samples, roots):
+        searched.append(len(samples))
+        return selectors.generate_matchers_for_samples(samples, roots)
+
+    monkeypatch.setattr(
+        training, "generate_matchers_for_samples", generate_matchers_for_samples
+    )
+    monkeypatch.setattr(training, "CANDIDATES_KEPT_MAX", 1)
+
+    items = [{"title": f"t{i}", "author": f"a{i}"} for i in range(3)]
+    trainer = IncrementalTrainer()
+    trainer.add_sample(Sample(make_page(0), items[0]))
+    assert searched == [1, 1]
+
+    # the candidates survive the new page, so no search runs
+    pages = [make_page(1)]
+    assert trainer.add_sample(Sample(pages[0], items[1])).get(pages[0]) == items[1]
+    assert searched == [1, 1]
+
+    # another h1 drops the kept candidate, only the title is searched again
+    pages.append(make_page(2, header="<h1>ad</h1>"))
+    scraper = trainer.add_sample(Sample(pages[1], items[2]))
+    assert searched == [1, 1, 3]
+    assert [scraper.get(p) for p in pages] == items[1:3]
+    assert repr(scraper) == repr(train_scraper(trainer.training_set.item))
+
+
+def test_incremental_trainer_list(monkeypatch):
+    def make_page(i, ad=""):
+        entries = "".join(
+            f'<li class="entry"><span class="name">n{i}{j}</span>'
+            f'<span class="n">{j}</span></li>'
+            for j in range(3)
+        )
+        return Page(f"<html><body><h1>t{i}</h1><ul>{ad}{entries}</ul></body></html>")
+
+    def make_item(i):
+        return [{"name": f"n{i}{j}", "n": str(j)} for j in range(3)]
+
+    searched = []
+
+    def generate_selector_for_nodes(nodes, roots):
+        searched.append(len(nodes))
+        return selectors.generate_selector_for_nodes(nodes, roots)
+
+    monkeypatch.setattr(
+        training, "generate_selector_for_nodes", generate_selector_for_nodes
+    )
+    monkeypatch.setattr(training, "CANDIDATES_KEPT_MAX", 1)
+
+    trainer = IncrementalTrainer()
+    pages = [make_page(0)]
+    trainer.add_sample(Sample(pages[0], make_item(0)))
+    assert searched == [3]
+
+    # the list selector survives the new page, so no search runs
+    pages.append(make_page(1))
+    scraper = trainer.add_sample(Sample(pages[1], make_item(1)))
+    assert searched == [3]
+    assert [scraper.get(p) for p in pages] == [make_item(i) for i in range(2)]
+
+    # another li drops the kept selector, the list is searched again
+    pages.append(make_page(2, ad="<li>ad</li>"))
+    scraper = trainer.add_sample(Sample(pages[2], make_item(2)))
+    assert searched == [3, 9]
+    assert [scraper.get(p) for p in pages] == [make_item(i) for i in range(3)]
+    assert scraper.selector.css_rule == "li.entry"
+
+
+def test_train_scraper_budget(make_article_training_set):
+    training_set = make_article_training_set()
+
+    unbounded = train_scraper(training_set.item)
+    bounded = train_scraper(training_set.item, budget=SearchBudget(timeout=60))
+    assert repr(bounded) == repr(unbounded)
+
+    # enough candidates for the title only
+    with pytest.raises(SearchBudgetExhaustedException) as exc_info:
+        train_scraper(training_set.item, budget=SearchBudget(max_candidates=1))
+    assert exc_info.value.items_trained == 1
+    assert exc_info.value.candidates_evaluated == 1
+    assert exc_info.value.item_path == ["author"]
+    assert "stopped at author" in str(exc_info.value)
+
+    with pytest.raises(SearchBudgetExhaustedException):
+        train_scraper(training_set.item, budget=SearchBudget(timeout=0))
+
+
+def test_train_scraper_budget_parallel(make_article_training_set):
+    training_set = make_article_training_set()
+
+    # candidates are counted over all workers, one is not enough for all keys
+    with pytest.raises(SearchBudgetExhaustedException):
+        train_scraper(
+            training_set.item, n_jobs=2, budget=SearchBudget(max_candidates=1)
+        )
+
+    budget = SearchBudget(max_candidates=3)
+    train_scraper(training_set.item, n_jobs=2, budget=budget)
+    assert budget.candidates_evaluated == 3
+
+
+def test_train_scraper_list_distinct_roots():
+    page = Page(
+        '<html><body><ul><li><p class="name">a</p><p class="n">1</p></li>'
+        '<li><p class="name">b</p><p class="n">2</p></li>'
+        '<li><p class="name">c</p><p class="n">1</p></li></ul></body></html>'
+    )
+    items = [{"name": "a", "n": "1"}, {"name": "b", "n": "2"}, {"name": "c", "n": "1"}]
+    training_set = make_training_set([page], [items])
+
+    scraper = train_scraper(training_set.item)
+    assert scraper.get(page) == items
+
+
+def test_train_scraper_frees_pages(make_article_training_set):
+    training_set = make_article_training_set()
+    scraper = train_scraper(training_set.item)
+    pages = [s.page for s in training_set.item.samples]
+    assert scraper.get(pages[0]) == training_set.item.samples[0].value
+    del training_set
+
+    # caches of the search are dropped once training returns
+    page_refs = [weakref.ref(page) for page in pages]
+    del pages
+    gc.collect()
+    assert all(page_ref() is None for page_ref in page_refs)
@@ -1,11 +1,21 @@
+import gc
+import weakref
+
 from bs4 import BeautifulSoup
 
 from mlscraper.util import (
     AttributeValueExtractor,
+    DictMatch,
+    LRUCache,
     Node,
     Page,
     _get_root_of_nodes,
+    count_nodes,
+    generate_node_ids,
     get_attribute_extractor,
+    get_common_ancestor,
+    get_node_bits,
+    get_relative_depth,
 )
 
 
@@ -22,6 +32,126 @@ class TestPage:
         nodes = page.find_all("/users/624900/jterrace")
         assert nodes
 
+    def test_node_identity(self):
+        page = Page("<html><body><p>1</p><p>2</p></body></html>")
+        nodes = page.select("p")
+        assert page.select("p") == nodes
+        assert all(n.page is page for n in nodes)
+        assert nodes[0].get_root() is page
+        assert page.find_all("1")[0].node is nodes[0]
+
+    def test_page_freed(self):
+        gc.disable()
+        try:
+            page = Page("<html><body><p>1</p></body></html>")
+            node = page.select("p")[0]
+            page_ref = weakref.ref(page)
+
+            # nodes keep their page alive
+            del page
+            assert page_ref() is node.page
+
+            # no reference cycles, so no garbage collection is needed
+            del node
+            assert page_ref() is None
+        finally:
+            gc.enable()
+
+    def test_structure(self):
+        page = Page(
+            "<html><body><div><p id='one'></p><p><span id='two'></span></p></div></body></html>"
+        )
+        div, one, two = [page.select(css)[0] for css in ("div", "#one", "#two")]
+
+        assert page.node_id == 0
+        assert [page.get_depth(n.node_id) for n in (div, one, two)] == [3, 4, 5]
+        assert page.get_parent_id(one.node_id) == div.node_id
+        assert page.get_node_by_id(two.node_id) is two
+
+        assert div.is_ancestor_of(two)
+        assert not one.is_ancestor_of(two)
+        assert not div.is_ancestor_of(div)
+
+        assert get_common_ancestor([one, two]) is div
+        assert get_common_ancestor([two]) is two
+        assert get_relative_depth(two, div) == 2
+
+    def test_common_ancestor_id(self):
+        with open("tests/static/so.html") as file:
+            page = Page(file.read())
+
+        # compare with walking the ancestor paths
+        node_count = page.get_node_count()
+        for step in (1, 7, 50, 333):
+            for start in range(0, node_count - step, 97):
+                node_ids = [start, start + step, (start * 31) % node_count]
+                expected = _get_root_of_nodes([page._soups[i] for i in node_ids])
+                ancestor_id = page.get_common_ancestor_id(node_ids)
+                assert page._soups[ancestor_id] is expected
+
+    def test_sibling_positions(self):
+        page = Page("<html><body><ul><li>1</li><p></p><li>1</li></ul></body></html>")
+        first, second = page.select("li")
+        assert page.get_sibling_positions(first.node_id) == (1, 1)
+        assert page.get_sibling_positions(second.node_id) == (3, 2)
+
+        # equal siblings still get their own position
+        selectors = list(second.generate_path_selectors())
+        assert ":nth-child(3)" in selectors
+        assert ":nth-of-type(2)" in selectors
+        assert selectors == list(Node(second.soup).generate_path_selectors())
+
+    def test_find_all_index(self):
+        page = Page(
+            '<html><body><p title="x">x</p><!--x--><a href="x">y</a></body></html>'
+        )
+        assert page._value_index is None
+
+        matches = page.find_all("x")
+        assert page._value_index is not None
+
+        # same matches in the same order as searching the tree
+        expected = list(Node._generate_find_all(page, "x"))
+        assert [(m.node, m.extractor) for m in matches] == [
+            (m.node, m.extractor) for m in expected
+        ]
+        assert page.find_all("missing") == []
+
+    def test_select_bits(self):
+        with open("tests/static/so.html") as file:
+            page = Page(file.read())
+        answers = page.select("#answers")[0]
+
+        for css_rule in ("div.answer span", "div > p", "a"):
+            node_ids = [n.node_id for n in answers.select(css_rule)]
+            assert list(generate_node_ids(answers.select_bits(css_rule))) == node_ids
+
+
+def test_node_bits():
+    node_ids = [0, 3, 7, 8, 1000]
+    bits = get_node_bits(node_ids)
+    assert bits == sum(1 << i for i in node_ids)
+    assert list(generate_node_ids(bits)) == node_ids
+    assert count_nodes(bits) == 5
+    assert get_node_bits([]) == 0
+
+
+def test_dict_match_slots():
+    page = Page("<html><body><div><p>1</p><p>2</p></div></body></html>")
+    one, two = page.find_all("1") + page.find_all("2")
+    keys = ("a", "b")
+
+    match = DictMatch.from_combination(keys, (one, two))
+    assert match.match_by_key == DictMatch({"a": one, "b": two}).match_by_key
+    assert match.keys is keys
+    assert match.get_root() is page.select("div")[0]
+    assert match.get_span() == 2
+
+    # slots, no dict per match or node
+    assert not hasattr(match, "__dict__")
+    assert not hasattr(one, "__dict__")
+    assert not hasattr(one.node, "__dict__")
+
 
 def test_attribute_extractor():
     soup = BeautifulSoup(
@@ -53,3 +183,16 @@ def test_get_root_of_nodes():
     node_2 = soup.select_one("#two")
     root = _get_root_of_nodes([node_1, node_2])
     assert root == soup.select_one("div")
+
+
+def test_lru_cache():
+    cache = LRUCache(maxsize=2)
+    assert cache.get_or_compute("a", lambda: 1) == 1
+    assert cache.get_or_compute("b", lambda: 2) == 2
+    assert cache.get_or_compute("a", lambda: 3) == 1
+
+    # b is least recently used and gets evicted
+    cache.get_or_compute("c", lambda: 4)
+    assert cache.get_or_compute("b", lambda: 5) == 5
+    assert cache.get_info() == (1, 4, 2, 2)
+    assert cache.get_hit_rate() == 0.2
@@ -0,0 +1,123 @@
+import pytest
+from lxml import etree
+
+from mlscraper.util import AttributeValueExtractor, Page, TextValueExtractor
+from mlscraper.xpath import LxmlPage, XPathTranslationException, css_to_xpath
+
+HTML = (
+    "<html><head><title>t</title><script>var x;</script></head><body>"
+    '<div id="main" class="x y"><p class="x">1<!-- c --> 2</p><p>  </p>'
+    '<div class="y"><span>3</span><p class="x z">4</p></div></div>'
+    '<ul><li class="x"><p>5</p></li><li><span class="x">6</span></li></ul>'
+    '<pre>  </pre><a rel="nofollow me" href="/a">7</a>'
+    '<p class="über" id="q\'&quot;">8</p>'
+    "</body></html>"
+)
+
+
+def get_node_pairs(html):
+    # soup and lxml nodes of the same elements, in document order
+    page = Page(html)
+    lxml_page = LxmlPage(html)
+    return zip(
+        [page.get_node(soup) for soup in page.soup.find_all()],
+        [lxml_page.get_node(e) for e in lxml_page.element.iter(etree.Element)],
+    )
+
+
+def test_css_to_xpath():
+    assert css_to_xpath("div.a #b") == (
+        "*[@id='b'][ancestor::*[self::div]"
+        "[contains(concat(' ', normalize-space(@class), ' '), ' a ')]]"
+    )
+    with pytest.raises(XPathTranslationException):
+        css_to_xpath("div > p")
+
+
+def test_select_same_as_soup():
+    page = Page(HTML)
+    lxml_page = LxmlPage(HTML)
+    css_selectors = [
+        "p",
+        ".x",
+        "p.x.z",
+        "#main p",
+        "div div p",
+        "html body",
+        ":nth-child(1) :nth-child(1)",
+        ":nth-of-type(2)",
+        "li:nth-of-type(2) span",
+        "section p",
+        "p.über",
+        "#q\\'\\\"",
+    ]
+    for css_selector in css_selectors:
+        expected = [n.get_text() for n in page.select(css_selector)]
+        assert [n.get_text() for n in lxml_page.select(css_selector)] == expected
+
+        for root, lxml_root in zip(page.select("div"), lxml_page.select("div")):
+            expected = [n.get_text() for n in root.select(css_selector)]
+            selected = lxml_root.select(css_selector)
+            assert [n.get_text() for n in selected] == expected
+
+
+def test_extract_same_as_soup():
+    for node, lxml_node in get_node_pairs(HTML):
+        assert node.soup.name == lxml_node.element.tag
+        assert TextValueExtractor().extract(lxml_node) == node.get_text()
+        for attr in ["class", "id", "rel", "href", "missing"]:
+            extractor = AttributeValueExtractor(attr)
+            assert extractor.extract(lxml_node) == extractor.extract(node)
+
+
+def test_extract_same_as_soup_stackoverflow():
+    with open("tests/static/so.html") as file:
+        html = file.read()
+    for node, lxml_node in get_node_pairs(html):
+        assert lxml_node.get_text() == node.get_text()
+
+
+def test_empty_page():
+    page = LxmlPage("")
+    assert page.select("p") == []
+    assert page.get_text() == ""
+
+
+def test_xml_declaration():
+    html = '<?xml version="1.0" encoding="utf-8"?>\n<html><body><p>caf\u00e9</p></body></html>'
+    for page in [LxmlPage(html), LxmlPage(html, ["p"])]:
+        assert [p.text for p in page.select("p")] == ["caf\u00e9"]
+    assert LxmlPage(html.encode()).select("p")[0].text == Page(html).select("p")[0].text
+
+
+def test_bytes_encoding():
+    # no charset, detected like soup does
+    html = "<html><body><h1>\u00fc title</h1></body></html>".encode()
+    expected = Page(html).select("h1")[0].text
+    assert LxmlPage(html).select("h1")[0].text == expected == "\u00fc title"
+    assert LxmlPage(html, ["h1"]).select("h1")[0].text == expected
+
+
+def test_parse_prefix():
+    tail = "<p class='filler'>filler</p>" * 5000
+    html = (
+        "<html><body><div class='a'><div class='a'>inner</div>outer</div>"
+        f"<h1 id='title'>title</h1>{tail}<span>last</span></body></html>"
+    )
+    page = LxmlPage(html, [".a", "#title"])
+    assert page.parsed_length < len(html)
+    assert page.select("span") == []
+
+    # the first match by document order is the outer div, complete before h1
+    full_page = LxmlPage(html)
+    for css_rule in [".a", "#title"]:
+        assert page.select(css_rule)[0].get_text() == (
+            full_page.select(css_rule)[0].get_text()
+        )
+
+
+def test_parse_prefix_unmatched():
+    html = "<html><body><p>1</p></body></html>"
+    page = LxmlPage(html, ["h1"])
+    assert page.parsed_length == len(html)
+    assert page.select("p")[0].get_text() == "1"